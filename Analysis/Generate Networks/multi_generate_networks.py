@@ -2,12 +2,25 @@
 # -*- coding: utf-8 -*-
 
 # This code produces multiple nanowire networks of specified parameters into folder    
+#
+# Every (nwires, seed, Lx) combination is an independent task. With --jobs N
+# the tasks run on a pool of N processes. Each produced file is recorded in
+# folder/manifest.csv together with its wire and junction counts and timing,
+# and tasks already in the manifest (whose file still exists) are skipped,
+# so an interrupted run can simply be started again.
 
 import wires
 import numpy as np
 
+import os
+import csv
+import json
+import time
+import hashlib
 import argparse
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 # Create parser for options
 parser = argparse.ArgumentParser(
     description='Handle parameters to generate a network of nanowires and junctions.')
@@ -88,11 +101,48 @@ parser.add_argument('--folder',
     help    ='The folder where the output files will be stored.')
 
 
+parser.add_argument('--wire_distances', 
+    type    = str, 
+    default = 'dense',
+    choices = ['dense', 'sparse', 'none'],
+    help    = 'How wire_distances is written to the .mat files: full matrix, sparse up to --distance_radius, or not at all.')
+
+parser.add_argument('--distance_radius', 
+    type    = float, 
+    default = None,
+    help    = 'Largest centre distance kept with --wire_distances sparse, in micrometres.')
+
 parser.add_argument('--oldNameConvention', 
     type    = bool, 
     default = False,
     help    = 'Whether or not to use old name convention (include cent dispersion and date), or new (include lx, ly, no date).')
     
+parser.add_argument('--grow', 
+    action  = 'store_true',
+    default = False,
+    help    = 'Drop wires in batches until the left and right sides of the device are connected, with nwires (or density) as the limit.')
+
+parser.add_argument('--format', 
+    type    = str, 
+    default = 'mat',
+    choices = ['mat', 'nwn', 'both'],
+    help    = 'Output format: .mat file, binary .nwn network directory, or both.')
+
+parser.add_argument('--cache', 
+    type    = str, 
+    default = None,
+    help    = 'Directory of the network cache. Networks generated before with the same parameters are loaded from it.')
+
+parser.add_argument('--cache_size', 
+    type    = float, 
+    default = 1.0,
+    help    = 'Size limit of the network cache in GB, least recently used networks are removed beyond it.')
+
+parser.add_argument('--jobs', 
+    type    = int, 
+    default = 1,
+    help    = 'Number of networks generated in parallel (processes).')
+
 parser.add_argument('--plot', 
     dest    = 'plot_network', 
     action  = 'store_true',
@@ -105,119 +155,218 @@ parser.add_argument('--no-plot',
     default = False,
     help    = 'Flag to not plot the figure (default).')    
 
-args = parser.parse_args()
-
-if args.nwiresMax == -1:
-    args.nwiresMax = args.nwires
-    
-if args.seedMax == -1:
-    args.seedMax = args.seed + 1
-
-if args.Ly == -1:
-    args.Ly = args.Lx
-    square = True
-else:
-    square = False
-
-if args.LxMax == -1:
-    args.LxMax = args.Lx
-
-mean_length     = args.mean_length
-std_length      = args.std_length
-shape           = args.shape
-cent_dispersion = args.cent_dispersion
-Lx              = args.Lx
-Ly              = args.Ly
-folder          = args.folder
-density         = args.density
-oldNameConvention  = args.oldNameConvention
-
-wireList = list(np.unique(np.linspace(args.nwires, args.nwiresMax, args.numSims, dtype = int)))
-seedList = range(args.seed, args.seedMax)
-LxList   = list(np.unique(np.linspace(args.Lx,     args.LxMax,     args.numSims, dtype = int)))
-
-print('multi_generate_networks:')
-
-if density == -1:
-    print('Seeds: ', list(seedList))
-    print('Wires: ', list(wireList))
-    print('Sizes: ', list(LxList))
-    fixedDensity = False
-else:
-    wireList = [-1]
-    print('Density: ', density)
-    print('Seeds: ', list(seedList))
-    print('Sizes: ', list(LxList))    
-    fixedDensity = True
-
-print('Fixed density = ', fixedDensity)
-print('Square = ', square)
-
-if oldNameConvention:
-    print('Using old name convention')
-
-
-for nwires in wireList: 
-    for seed in seedList:
-        for Lx in LxList:
-            if square:
-                Ly = Lx         
-            if fixedDensity:
-                nwires = int(density*Lx*Ly)
-            
-            print('Now generating: nwires = ', nwires, ', seed = ', seed, ' grid = ', Lx, 'x', Ly, 'um^2')
-            # Generate the network
-            wires_dict = wires.generate_wires_distribution(number_of_wires = nwires,
-                                                     wire_av_length = mean_length,
-                                                     wire_dispersion = std_length,
-                                                     gennorm_shape = shape,
-                                                     centroid_dispersion= cent_dispersion,
-                                                     this_seed = seed,
-                                                     Lx = Lx,
-                                                     Ly = Ly, 
-                                                     oldNameConvention = oldNameConvention)
-
-
-            # Get junctions list and their positions
-            wires_dict = wires.detect_junctions(wires_dict)
-
-            # Genreate graph object and adjacency matrix
-            wires_dict = wires.generate_graph(wires_dict)
-            
-            
-            if not wires.check_connectedness(wires_dict):
-                wires_dict = wires.select_largest_component(wires_dict)
-            
-            
-            #Calculate network statistics
-            #wires_dict = wires.analyse_network(wires_dict)
-
-            wires.export_to_matlab(wires_dict, folder = folder)
-            
-            if args.plot_network:
-             
-                # Plotting tools
-                from matplotlib.lines import Line2D
-                from matplotlib.patches import Rectangle
-                import matplotlib.pyplot as plt
-
-                # Plot pretty pictures of what we just did
-                fig, ax = plt.subplots()
-                fig.set_size_inches(5,5)
-
-                Lx = wires_dict['length_x']
-                Ly = wires_dict['length_y']
-
-                ax.add_patch(Rectangle((0,0), Lx, Ly, color=(1.0, 0.918, 0.0), alpha=0.77))     
-                ax = wires.draw_wires(ax, wires_dict)
-                ax = wires.draw_junctions(ax, wires_dict)
-                ax.set_aspect(1) # set aspect ratio to 1
-                ax.set_xlabel(r'x [$\mu$m]')
-                ax.set_ylabel(r'y [$\mu$m]')
-                ax.ticklabel_format(style='sci', axis='x', scilimits=(0,0))
-                ax.ticklabel_format(style='sci', axis='y', scilimits=(0,0))
-                ax.axis([-.1*Lx,1.1*Lx,-.1*Lx,1.1*Lx]) # add some space around the unit square
-                ax.set_title('Nanowires distribution')
-                ax.grid()
-                plt.show()       
- 
+manifest_fields = ['key', 'nwires', 'seed', 'Lx', 'Ly', 'number_of_wires',
+                   'number_of_junctions', 'filename', 'elapsed']
+
+
+def task_key(task):
+    return hashlib.sha1(json.dumps(task, sort_keys=True).encode()).hexdigest()[0:16]
+
+
+def read_manifest(folder):
+    path = os.path.join(folder, 'manifest.csv')
+    if not os.path.isfile(path):
+        return {}
+    with open(path, newline='') as f:
+        return {row['key']: row for row in csv.DictReader(f)}
+
+
+def run_task(task, cache_dir = None, max_cache_bytes = 2**30):
+    """
+    Generate, select and export one network. task holds every parameter,
+    so this can run in any process. Returns the manifest row and the
+    network dictionary.
+    """
+    start = time.time()
+    if task['grow']:
+        # Stops as soon as the network percolates, not cached
+        wires_dict = wires.grow_network(wire_av_length = task['mean_length'],
+                                        wire_dispersion = task['std_length'],
+                                        Lx = task['Lx'],
+                                        Ly = task['Ly'],
+                                        this_seed = task['seed'],
+                                        max_wires = task['nwires'],
+                                        oldNameConvention = task['oldNameConvention'])
+        wires_dict = wires.generate_graph(wires_dict)
+        if not wires.check_connectedness(wires_dict):
+            wires_dict = wires.select_largest_component(wires_dict)
+    else:
+        # Generate the network (junctions, graph, largest component), or  
+        # load it from the cache
+        wires_dict = wires.generate_network(number_of_wires = task['nwires'],
+                                            wire_av_length = task['mean_length'],
+                                            wire_dispersion = task['std_length'],
+                                            gennorm_shape = task['shape'],
+                                            centroid_dispersion= task['cent_dispersion'],
+                                            this_seed = task['seed'],
+                                            Lx = task['Lx'],
+                                            Ly = task['Ly'], 
+                                            oldNameConvention = task['oldNameConvention'],
+                                            cache_dir = cache_dir,
+                                            max_cache_bytes = max_cache_bytes)
+
+    #Calculate network statistics
+    #wires_dict = wires.analyse_network(wires_dict)
+
+    if task['format'] in ['mat', 'both']:
+        pathfile = wires.export_to_matlab(wires_dict, folder = task['folder'],
+                                          wire_distances = None if task['wire_distances'] == 'none' else task['wire_distances'],
+                                          distance_radius = task['distance_radius'])
+    if task['format'] in ['nwn', 'both']:
+        filename = os.path.splitext(os.path.basename(pathfile))[0] if task['format'] == 'both' else None
+        pathfile = wires.export_to_network(wires_dict, filename = filename, folder = task['folder'])
+
+    row = dict(key = task_key(task),
+               nwires = task['nwires'], seed = task['seed'], Lx = task['Lx'], Ly = task['Ly'],
+               number_of_wires = wires_dict['number_of_wires'],
+               number_of_junctions = wires_dict['number_of_junctions'],
+               filename = os.path.basename(pathfile),
+               elapsed = '%.2f' % (time.time() - start))
+    return row, wires_dict
+
+
+def run_task_row(task, cache_dir, max_cache_bytes):
+    # Only the manifest row is sent back from the worker processes
+    return run_task(task, cache_dir, max_cache_bytes)[0]
+
+
+def plot_network(wires_dict):
+    # Plotting tools
+    from matplotlib.lines import Line2D
+    from matplotlib.patches import Rectangle
+    import matplotlib.pyplot as plt
+
+    # Plot pretty pictures of what we just did
+    fig, ax = plt.subplots()
+    fig.set_size_inches(5,5)
+
+    Lx = wires_dict['length_x']
+    Ly = wires_dict['length_y']
+
+    ax.add_patch(Rectangle((0,0), Lx, Ly, color=(1.0, 0.918, 0.0), alpha=0.77))     
+    ax = wires.draw_wires(ax, wires_dict)
+    ax = wires.draw_junctions(ax, wires_dict)
+    ax.set_aspect(1) # set aspect ratio to 1
+    ax.set_xlabel(r'x [$\mu$m]')
+    ax.set_ylabel(r'y [$\mu$m]')
+    ax.ticklabel_format(style='sci', axis='x', scilimits=(0,0))
+    ax.ticklabel_format(style='sci', axis='y', scilimits=(0,0))
+    ax.axis([-.1*Lx,1.1*Lx,-.1*Lx,1.1*Lx]) # add some space around the unit square
+    ax.set_title('Nanowires distribution')
+    ax.grid()
+    plt.show()
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    if args.nwiresMax == -1:
+        args.nwiresMax = args.nwires
+        
+    if args.seedMax == -1:
+        args.seedMax = args.seed + 1
+
+    if args.Ly == -1:
+        args.Ly = args.Lx
+        square = True
+    else:
+        square = False
+
+    if args.LxMax == -1:
+        args.LxMax = args.Lx
+
+    Ly              = args.Ly
+    folder          = args.folder
+    density         = args.density
+    oldNameConvention  = args.oldNameConvention
+
+    wireList = list(np.unique(np.linspace(args.nwires, args.nwiresMax, args.numSims, dtype = int)))
+    seedList = range(args.seed, args.seedMax)
+    LxList   = list(np.unique(np.linspace(args.Lx,     args.LxMax,     args.numSims, dtype = int)))
+
+    print('multi_generate_networks:')
+
+    if density == -1:
+        print('Seeds: ', list(seedList))
+        print('Wires: ', list(wireList))
+        print('Sizes: ', list(LxList))
+        fixedDensity = False
+    else:
+        wireList = [-1]
+        print('Density: ', density)
+        print('Seeds: ', list(seedList))
+        print('Sizes: ', list(LxList))    
+        fixedDensity = True
+
+    print('Fixed density = ', fixedDensity)
+    print('Square = ', square)
+
+    if oldNameConvention:
+        print('Using old name convention')
+
+    tasks = []
+    for nwires in wireList: 
+        for seed in seedList:
+            for Lx in LxList:
+                if square:
+                    Ly = Lx         
+                if fixedDensity:
+                    nwires = int(density*Lx*Ly)
+                tasks.append(dict(nwires = int(nwires), seed = int(seed),
+                                  Lx = float(Lx), Ly = float(Ly),
+                                  mean_length = args.mean_length,
+                                  std_length = args.std_length,
+                                  shape = args.shape,
+                                  cent_dispersion = args.cent_dispersion,
+                                  oldNameConvention = oldNameConvention,
+                                  wire_distances = args.wire_distances,
+                                  distance_radius = args.distance_radius,
+                                  format = args.format,
+                                  grow = args.grow,
+                                  folder = folder))
+
+    cache_dir       = args.cache
+    max_cache_bytes = int(args.cache_size*2**30)
+
+    manifest = read_manifest(folder)
+    todo = [task for task in tasks
+            if task_key(task) not in manifest
+            or not os.path.exists(os.path.join(folder, manifest[task_key(task)]['filename']))]
+    print('%d networks, %d done, %d to go.' % (len(tasks), len(tasks)-len(todo), len(todo)))
+
+    if args.plot_network and args.jobs > 1:
+        print('--plot is ignored with --jobs > 1.')
+
+    if len(todo) > 0:
+        os.makedirs(folder, exist_ok = True)
+        path = os.path.join(folder, 'manifest.csv')
+        newFile = not os.path.isfile(path)
+        with open(path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames = manifest_fields)
+            if newFile:
+                writer.writeheader()
+
+            def report(count, row):
+                print('[%d/%d] %s: %d wires, %d junctions, %s s' % (count, len(todo), row['filename'],
+                      row['number_of_wires'], row['number_of_junctions'], row['elapsed']))
+                writer.writerow(row)
+                f.flush()
+
+            if args.jobs > 1:
+                with ProcessPoolExecutor(max_workers = args.jobs) as pool:
+                    futures = {pool.submit(run_task_row, task, cache_dir, max_cache_bytes): task for task in todo}
+                    for count, future in enumerate(as_completed(futures), 1):
+                        task = futures[future]
+                        try:
+                            row = future.result()
+                        except Exception as error:
+                            print('nwires = %d, seed = %d, Lx = %g failed: %s' % (task['nwires'], task['seed'], task['Lx'], error))
+                            continue
+                        report(count, row)
+            else:
+                for count, task in enumerate(todo, 1):
+                    print('Now generating: nwires = ', task['nwires'], ', seed = ', task['seed'], ' grid = ', task['Lx'], 'x', task['Ly'], 'um^2')
+                    row, wires_dict = run_task(task, cache_dir, max_cache_bytes)
+                    report(count, row)
+                    if args.plot_network:
+                        plot_network(wires_dict)
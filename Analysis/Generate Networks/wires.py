@@ -14,8 +14,9 @@ wire's orientation.
 
 from __future__ import  division
 
-from itertools import *
 from scipy.io import savemat
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from scipy.spatial.distance import cdist
 from scipy.stats import gennorm
 
@@ -84,9 +85,6 @@ def generate_wires_distribution(number_of_wires=1500,
     xa, ya  = xc - wire_lengths/2.0 * np.cos(theta), yc - wire_lengths/2.0 * np.sin(theta) # coordinates for one end 
     xb, yb  = xc + wire_lengths/2.0 * np.cos(theta), yc + wire_lengths/2.0 * np.sin(theta) # coordinates for the other end
 
-    # Compute the Euclidean distance between pair of region centres
-    wire_distances = cdist(np.array([xc, yc]).T, np.array([xc, yc]).T, metric='euclidean')    
-
     # Find values outside the domain
     a = np.where(np.vstack([xa, xb, ya, yb]) < 0.0, True, False).sum(axis=0)
     b = np.where(np.vstack([xa, xb]) > Lx, True, False).sum(axis=0)
@@ -107,7 +105,6 @@ def generate_wires_distribution(number_of_wires=1500,
                 length_x = Lx,
                 length_y = Ly,
                 number_of_wires = number_of_wires,
-                wire_distances = wire_distances,
                 oldNameConvention = oldNameConvention)
 
 
@@ -198,8 +195,6 @@ def generate_lattice (number_of_wires=1500,
     Lx = max(np.append(xa,xb))
     Ly = max(np.append(ya,yb))
     
-    wire_distances = cdist(np.array([xc, yc]).T, np.array([xc, yc]).T, metric='euclidean')
-
     # Find values outside the domain
     a = np.where(np.vstack([xa, xb, ya, yb]) < 0.0, True, False).sum(axis=0)
     b = np.where(np.vstack([xa, xb]) > Lx, True, False).sum(axis=0)
@@ -218,7 +213,6 @@ def generate_lattice (number_of_wires=1500,
                 length_x = Lx,
                 length_y = Ly,
                 number_of_wires = number_of_wires,
-                wire_distances = wire_distances,
                 gennorm_shape = 0,
                 dispersion = 0,
                 factors = factors) # What is inside factors?
@@ -288,60 +282,82 @@ def find_segment_intersection(p0, p1, p2, p3):
         return xi, yi
 
 
+def wire_kdtree(wires_dict):
+    """
+    KD-tree of the wire centres, for neighbour and radius queries
+    (e.g. tree.query_ball_point, tree.query) without the dense
+    number_of_wires x number_of_wires distance matrix.
+    """
+    from scipy.spatial import cKDTree
+    return cKDTree(np.column_stack([wires_dict['xc'], wires_dict['yc']]))
+
+
+def compute_wire_distances(wires_dict, radius=None):
+    """
+    Euclidean distances between wire centres, computed on demand.
+
+    Parameters
+    ----------
+    wires_dict: dict
+    radius: float
+        if given, only the distances up to radius are kept and a
+        scipy.sparse CSR matrix is returned (zero meaning farther than
+        radius); otherwise the dense matrix, which needs 8 N^2 bytes.
+
+    Returns
+    -------
+    distances: array or scipy.sparse.csr_matrix
+    """
+    if radius is None:
+        centres = np.array([wires_dict['xc'], wires_dict['yc']]).T
+        return cdist(centres, centres, metric='euclidean')
+    tree = wire_kdtree(wires_dict)
+    return tree.sparse_distance_matrix(tree, radius, output_type='coo_matrix').tocsr()
+
+
 def select_largest_component(wires_dict):
     """
     Find and select largest connected component of the original graph G.
     Throws away unconnected components and updates all the keys in wires_dict 
+
+    Wires keep their relative order and are renumbered contiguously, 
+    edge_list is sorted by first then second wire, and xi, yi are 
+    reordered with it so they stay aligned with edge_list.
     """
-    G=wires_dict['G']
-    wires_dict['G'] = max([G.subgraph(c) for c in nx.connected_components(G)], key=len)
-    nw = len(wires_dict['G'].nodes())
-    nj = len(wires_dict['G'].edges())   
-    
+    # Labels follow the lowest node of each component, so argmax picks the
+    # same component as max() over nx.connected_components on ties
+    _, labels = connected_components(wires_dict['adj_matrix'], directed=False)
+    keep = labels == np.argmax(np.bincount(labels))
+    nw = int(keep.sum())
+
+    # old wire index -> new wire index, -1 for the discarded wires
+    node_mapping = np.full(keep.size, -1, dtype=np.int64)
+    node_mapping[keep] = np.arange(nw)
+
+    edge_list = np.asarray(wires_dict['edge_list'], dtype=np.int64).reshape(-1, 2)
+    # both ends of an edge are in the same component
+    keep_edges = keep[edge_list[:, 0]]
+    edge_list = node_mapping[edge_list[keep_edges]]
+    # Swap node vertices if vertex 0 is larger than vertex 1, then sort
+    edge_list = np.sort(edge_list, axis=1)
+    order = np.lexsort((edge_list[:, 1], edge_list[:, 0]))
+    edge_list = edge_list[order]
+    nj = len(edge_list)
+
     logging.info("The largest component has %5d nodes and %6d edges", nw, nj)
 
     # Replace values in the dictionary
     wires_dict['generating_number_of_wires']     =  wires_dict['number_of_wires']    
     wires_dict['number_of_wires']     = nw
     wires_dict['number_of_junctions'] = nj
-    wires_dict['xa'] = wires_dict['xa'][sorted(wires_dict['G'].nodes())] 
-    wires_dict['ya'] = wires_dict['ya'][sorted(wires_dict['G'].nodes())] 
-    wires_dict['xb'] = wires_dict['xb'][sorted(wires_dict['G'].nodes())] 
-    wires_dict['yb'] = wires_dict['yb'][sorted(wires_dict['G'].nodes())]
-    wires_dict['xc'] = wires_dict['xc'][sorted(wires_dict['G'].nodes())] 
-    wires_dict['yc'] = wires_dict['yc'][sorted(wires_dict['G'].nodes())]
-    			
-    # Keep old edge_list
-    old_edge_list = [(ii, kk) for ii, kk in  zip(wires_dict['edge_list'][:, 0], wires_dict['edge_list'][:, 1])]
-    # Remove old edge list
-    wires_dict = remove_key(wires_dict, 'edge_list') 
-    # Save indices of intersections in the old graph
-    ind_dict = {key:value for value,key in enumerate(old_edge_list)}
-    new_edge_list = sorted([kk if kk[0] < kk[1] else (kk[1], kk[0]) for kk in wires_dict['G'].edges()], key=lambda x: x[0])
-    # Find intersection between the two sets
-    inter = set(ind_dict).intersection(new_edge_list)
-    # Retrieve edge indices/positions from the old list
-    edges_idx = [ind_dict[idx] for idx in inter]
-       
-    # These have length equal to number of junctions -- only get the ones we need
-    wires_dict['xi'] = wires_dict['xi'][edges_idx] 
-    wires_dict['yi'] = wires_dict['yi'][edges_idx] 
-    
-    # Get contiguous numbering of nodes
-    # Build node mapping 
-    node_mapping    = {key:value for value, key in enumerate(sorted(wires_dict['G'].nodes()))}
-    # This  step also renames edges list
-    wires_dict['G'] =  nx.relabel_nodes(wires_dict['G'] , node_mapping)
-
-    # Swap node vertices if vertex 0 is larger than vertex 1, then sort by first element
-    wires_dict['edge_list'] = np.asarray(sorted([kk if kk[0] < kk[1] else (kk[1], kk[0]) for kk in wires_dict['G'].edges()], key=lambda x: x[0]))
-    
-    # Save adjacency matrix of new graph
-    wires_dict = remove_key(wires_dict, 'adj_matrix') 
-    wires_dict = generate_adj_matrix(wires_dict)
+    for key in ['xa', 'ya', 'xb', 'yb', 'xc', 'yc']:
+        wires_dict[key] = wires_dict[key][keep]
+    wires_dict['xi'] = wires_dict['xi'][keep_edges][order] 
+    wires_dict['yi'] = wires_dict['yi'][keep_edges][order] 
+    wires_dict['edge_list'] = edge_list
 
-    wire_distances = cdist(np.array([wires_dict['xc'], wires_dict['yc']]).T, np.array([wires_dict['xc'], wires_dict['yc']]).T, metric='euclidean')    
-    wires_dict['wire_distances'] = wire_distances
+    # Rebuild the adjacency matrix and graph of the component
+    wires_dict = generate_graph(wires_dict)
 
     return wires_dict 
 
@@ -390,12 +406,156 @@ def detect_lattice_junctions(wires_dict):
     return wires_dict
 
 
+def find_candidate_pairs(xa, ya, xb, yb, cell_size=None):
+    """
+    Broad phase of the junction detection. Bins the bounding box of every
+    wire into a uniform grid of cells about one wire long and returns the
+    pairs of wires that share a cell, i.e. the only pairs whose bounding
+    boxes can overlap.
+
+    Parameters
+    ----------
+    xa, ya, xb, yb : array
+        end point coordinates of the wires
+    cell_size : float
+        side of the grid cells, defaults to the mean wire length
+
+    Returns
+    -------
+    pairs : array
+        (n, 2) wire indices, i < j, sorted like
+        itertools.combinations(range(number_of_wires), 2)
+    """
+    number_of_wires = xa.size
+    xmin, xmax = np.minimum(xa, xb), np.maximum(xa, xb)
+    ymin, ymax = np.minimum(ya, yb), np.maximum(ya, yb)
+    if cell_size is None:
+        cell_size = np.mean(np.hypot(xb - xa, yb - ya))
+    span = max(xmax.max() - xmin.min(), ymax.max() - ymin.min(), 1.0)
+    if not cell_size > 0:
+        cell_size = span
+    # Boxes are grown by a rounding margin so that touching wires
+    # always share a cell
+    eps = 1e-9 * span
+    x0, y0 = xmin.min() - eps, ymin.min() - eps
+    ix0 = np.floor((xmin - eps - x0) / cell_size).astype(np.int64)
+    ix1 = np.floor((xmax + eps - x0) / cell_size).astype(np.int64)
+    iy0 = np.floor((ymin - eps - y0) / cell_size).astype(np.int64)
+    iy1 = np.floor((ymax + eps - y0) / cell_size).astype(np.int64)
+    nx_cells = ix1.max() + 1
+
+    # One entry per (wire, cell) the wire's box covers
+    wx, wy = ix1 - ix0 + 1, iy1 - iy0 + 1
+    count = wx * wy
+    wire = np.repeat(np.arange(number_of_wires), count)
+    local = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    cell = (np.repeat(iy0, count) + local // np.repeat(wx, count)) * nx_cells + \
+           np.repeat(ix0, count) + local % np.repeat(wx, count)
+
+    # All pairs within each cell
+    order = np.lexsort((wire, cell))
+    cell, wire = cell[order], wire[order]
+    boundaries = np.flatnonzero(np.diff(cell)) + 1
+    group_end = np.repeat(np.concatenate([boundaries, [cell.size]]),
+                          np.diff(np.concatenate([[0], boundaries, [cell.size]])))
+    partners = group_end - np.arange(cell.size) - 1
+    first = np.repeat(np.arange(cell.size), partners)
+    second = first + 1 + np.arange(partners.sum()) - np.repeat(np.cumsum(partners) - partners, partners)
+    keys = np.unique(wire[first].astype(np.int64) * number_of_wires + wire[second])
+
+    return np.column_stack([keys // number_of_wires, keys % number_of_wires])
+
+
+def find_segment_intersections(p0, p1, p2, p3, chunk_size=2**20, tol=0.0):
+    """
+    Batch version of find_segment_intersection using the cross-product
+    form, which has no special cases for vertical wires.
+
+    Segment k goes from p0[k] to p1[k] and is tested against the segment
+    from p2[k] to p3[k]. With r = p1 - p0, s = p3 - p2 and q = p2 - p0 the
+    segments meet at p0 + t r = p2 + u s where
+
+        t = (q x s) / (r x s),   u = (q x r) / (r x s),   0 <= t, u <= 1
+
+    Collinear segments (r x s = 0 and q x r = 0) that overlap are reported
+    at the middle of the overlap, e.g. wires touching end to end on a
+    lattice. Parallel and zero-length segments never intersect.
+
+    Parameters
+    ----------
+    p0, p1, p2, p3 : array
+        (n, 2) x, y coordinates of the segment end points
+    chunk_size : int
+        number of pairs processed at once, bounds the temporary memory
+    tol : float
+        slack on t and u (and on collinearity, relative), so that wires
+        whose ends only touch up to rounding are counted
+
+    Returns
+    -------
+    found : array of bool
+        (n,) whether the segments intersect
+    xi, yi : array
+        (n,) coordinates of the intersections, NaN where found is False
+    """
+    p0, p1 = np.asarray(p0, dtype=float), np.asarray(p1, dtype=float)
+    p2, p3 = np.asarray(p2, dtype=float), np.asarray(p3, dtype=float)
+    n = p0.shape[0]
+    found = np.zeros(n, dtype=bool)
+    xi = np.full(n, np.nan)
+    yi = np.full(n, np.nan)
+
+    for start in range(0, n, chunk_size):
+        c = slice(start, min(start + chunk_size, n))
+        r = p1[c] - p0[c]
+        s = p3[c] - p2[c]
+        q = p2[c] - p0[c]
+        rxs = r[:, 0] * s[:, 1] - r[:, 1] * s[:, 0]
+        qxs = q[:, 0] * s[:, 1] - q[:, 1] * s[:, 0]
+        qxr = q[:, 0] * r[:, 1] - q[:, 1] * r[:, 0]
+        rr = np.einsum('ij,ij->i', r, r)
+        ss = np.einsum('ij,ij->i', s, s)
+        scale = np.sqrt(rr * ss)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Proper crossings
+            crossing = np.abs(rxs) > tol * scale
+            t = qxs / rxs
+            u = qxr / rxs
+            hit = crossing & (t >= -tol) & (t <= 1 + tol) & (u >= -tol) & (u <= 1 + tol)
+            x = p0[c, 0] + t * r[:, 0]
+            y = p0[c, 1] + t * r[:, 1]
+
+            # Collinear overlaps, in units of r along the first segment
+            collinear = ~crossing & (np.abs(qxr) <= tol * scale) & (rr > 0) & (ss > 0)
+            t0 = np.einsum('ij,ij->i', q, r) / rr
+            t1 = t0 + np.einsum('ij,ij->i', s, r) / rr
+            lo = np.maximum(np.minimum(t0, t1), 0)
+            hi = np.minimum(np.maximum(t0, t1), 1)
+            overlap = collinear & (lo <= hi + tol)
+            middle = (lo + hi) / 2
+            x = np.where(overlap, p0[c, 0] + middle * r[:, 0], x)
+            y = np.where(overlap, p0[c, 1] + middle * r[:, 1], y)
+
+        hit |= overlap
+        found[c] = hit
+        xi[c] = np.where(hit, x, np.nan)
+        yi[c] = np.where(hit, y, np.nan)
+
+    return found, xi, yi
+
+
 def detect_junctions(wires_dict):
     """
     Find all the pairwise intersections of the wires contained in wires_dict.
     Adds four keys to the dictionary: junction coordinates, edge list, and
     number of junctions.
 
+    Only the pairs returned by find_candidate_pairs are tested, with
+    find_segment_intersections, so the cost grows with the number of
+    junctions rather than the number of pairs. Vertical and horizontal
+    wires (e.g. from generate_lattice) are handled like any other.
+
     Parameters
     ----------
     wires_dict: dict
@@ -407,38 +567,34 @@ def detect_junctions(wires_dict):
 
     """
     logging.info('Detecting junctions')
-    xi, yi, edge_list = [], [], []
-    for this_wire, that_wire in combinations(range(wires_dict['number_of_wires']), 2):
-
-        xa, ya = wires_dict['xa'][this_wire], wires_dict['ya'][this_wire]
-        xb, yb = wires_dict['xb'][this_wire], wires_dict['yb'][this_wire]
-
-        p0 = np.array([xa, ya])
-        p1 = np.array([xb, yb])
-
-        xa, ya = wires_dict['xa'][that_wire], wires_dict['ya'][that_wire]
-        xb, yb = wires_dict['xb'][that_wire], wires_dict['yb'][that_wire]
-
-        p2 = np.array([xa, ya])
-        p3 = np.array([xb, yb])
-
-        # Find junctions
-        J = find_segment_intersection(p0, p1, p2, p3)
+    xa, ya = np.asarray(wires_dict['xa'], dtype=float), np.asarray(wires_dict['ya'], dtype=float)
+    xb, yb = np.asarray(wires_dict['xb'], dtype=float), np.asarray(wires_dict['yb'], dtype=float)
 
-        if J is not False:
-        # Save coordinates
-            xi.append(J[0])
-            yi.append(J[1])
-            # Save node indices for every edge
-            edge_list.append([this_wire, that_wire])
+    pairs = find_candidate_pairs(xa, ya, xb, yb)
+    xi, yi, edge_list = [], [], []
+    chunk_size = 2**20
+    for start in range(0, len(pairs), chunk_size):
+        this_chunk = pairs[start:start + chunk_size]
+        i, j = this_chunk[:, 0], this_chunk[:, 1]
+        found, x, y = find_segment_intersections(np.column_stack([xa[i], ya[i]]),
+                                                 np.column_stack([xb[i], yb[i]]),
+                                                 np.column_stack([xa[j], ya[j]]),
+                                                 np.column_stack([xb[j], yb[j]]),
+                                                 chunk_size=chunk_size)
+        xi.append(x[found])
+        yi.append(y[found])
+        edge_list.append(this_chunk[found])
+    xi = np.concatenate(xi) if xi else np.array([])
+    yi = np.concatenate(yi) if yi else np.array([])
+    edge_list = np.concatenate(edge_list) if edge_list else np.zeros((0, 2), dtype=int)
 
     # Save centres coordinates and edge list to dict
     # if there are junctions
-    if len(edge_list) is not 0:
+    if len(edge_list) != 0:
         wires_dict['number_of_junctions'] = len(edge_list)
-        wires_dict['xi'] = np.asarray(xi)
-        wires_dict['yi'] = np.asarray(yi)
-        wires_dict['edge_list'] = np.asarray(edge_list)
+        wires_dict['xi'] = xi
+        wires_dict['yi'] = yi
+        wires_dict['edge_list'] = edge_list
         logging.info('Finished detecting junctions')
         return wires_dict
     
@@ -447,8 +603,8 @@ def detect_junctions(wires_dict):
 
 def generate_adj_matrix(wires_dict):
     """
-generate_wires_distribution    This function will produce adjaceny matrix of 
-    the physical network
+    This function will produce the adjaceny matrix of the physical 
+    network as a sparse (CSR) matrix, built straight from the edge list.
 
     Parameters
     ----------
@@ -463,13 +619,13 @@ generate_wires_distribution    This function will produce adjaceny matrix of
         The same dictionary with added key:value pairs adjacency matrix 
     """
 
-    # Create array -- maybe use sparse matrix?
-    adj_matrix_shape = (wires_dict['number_of_wires'], wires_dict['number_of_wires'])
-    adj_matrix = np.zeros(adj_matrix_shape, dtype=np.float32)
-    adj_matrix[wires_dict['edge_list'].astype(np.int32)[:, 0], wires_dict['edge_list'].astype(np.int32)[:, 1]] = 1.0
-    
-    # Make the matrix symmetric
-    adj_matrix = adj_matrix + adj_matrix.T
+    nw = wires_dict['number_of_wires']
+    edge_list = np.asarray(wires_dict['edge_list'], dtype=np.int64).reshape(-1, 2)
+
+    # Both directions at once, so the matrix is symmetric
+    rows = np.concatenate((edge_list[:, 0], edge_list[:, 1]))
+    cols = np.concatenate((edge_list[:, 1], edge_list[:, 0]))
+    adj_matrix = coo_matrix((np.ones(rows.size, dtype=np.float32), (rows, cols)), shape=(nw, nw)).tocsr()
 
     wires_dict['adj_matrix'] = adj_matrix
 
@@ -495,9 +651,12 @@ def generate_graph(wires_dict):
     """
 
 
-    # Create graph - this is going to be a memory pig for large matrices
     wires_dict = generate_adj_matrix(wires_dict)
-    G = nx.from_numpy_matrix(np.matrix(wires_dict['adj_matrix']))
+
+    # Graph from the edge list, isolated wires are kept as nodes
+    G = nx.Graph()
+    G.add_nodes_from(range(wires_dict['number_of_wires']))
+    G.add_edges_from(np.asarray(wires_dict['edge_list'], dtype=np.int64).reshape(-1, 2).tolist())
 
     wires_dict['G'] = G
 
@@ -541,7 +700,7 @@ def analyse_network(wires_dict):
     wires_dict['avg_nd'] = nx.number_of_edges(graph)*2.0/nx.number_of_nodes(graph)
     
     #standard deviation of node degree
-    degrees = np.sum(wires_dict['adj_matrix'], axis=0) #sums along columns
+    degrees = np.asarray(wires_dict['adj_matrix'].sum(axis=0)).ravel() #sums along columns
     wires_dict['std_nd'] = np.std(degrees)
     
     return wires_dict
@@ -559,11 +718,9 @@ def check_connectedness(wires_dict):
 
     """
     
-    G = wires_dict['G']
-
-    if not nx.is_connected(G):
-        nc = nx.number_connected_components(G)
+    nc, _ = connected_components(wires_dict['adj_matrix'], directed=False)
 
+    if nc > 1:
         logging.warning("This graph has %4d connected components", nc) 
         return False
 
@@ -611,6 +768,247 @@ def reconnect_graph(wires_dict,scale_num_wires,scale_dispersion,scale_length, fa
 
 
 
+class UnionFind(object):
+    """
+    Disjoint sets of wires for incremental connectivity. Every set also 
+    records whether it contains a wire of the source and of the drain 
+    region, so percolation is known as soon as the two meet.
+    """
+
+    def __init__(self):
+        self.parent = np.zeros(0, dtype=np.int64)
+        self.source = np.zeros(0, dtype=bool)
+        self.drain  = np.zeros(0, dtype=bool)
+
+    def add(self, source, drain):
+        """Add one singleton set per entry of the boolean arrays."""
+        n = self.parent.size
+        self.parent = np.concatenate([self.parent, np.arange(n, n + len(source))])
+        self.source = np.concatenate([self.source, source])
+        self.drain  = np.concatenate([self.drain, drain])
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            # path halving
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        """Merge the sets of i and j and return the root of the result."""
+        ri, rj = self.find(i), self.find(j)
+        if ri != rj:
+            self.parent[rj] = ri
+            self.source[ri] |= self.source[rj]
+            self.drain[ri]  |= self.drain[rj]
+        return ri
+
+    def percolates(self, i):
+        r = self.find(i)
+        return self.source[r] and self.drain[r]
+
+
+def in_region(x, y, region):
+    """Points inside region = (xmin, xmax, ymin, ymax)."""
+    xmin, xmax, ymin, ymax = region
+    return (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+
+
+def grow_network(wire_av_length=14.0, 
+                 wire_dispersion=5.0,
+                 Lx=3e3, Ly=3e3, 
+                 this_seed=42,
+                 batch_size=500,
+                 max_wires=None,
+                 source_region=None,
+                 drain_region=None,
+                 target_density=None,
+                 oldNameConvention = False):
+    '''
+    Drops nanowires on the device in batches, detecting the junctions of 
+    every new batch against the wires already in place, until the source 
+    and drain regions are connected or the junction density reaches 
+    target_density, instead of regenerating whole networks like 
+    reconnect_graph does.
+
+    The wires are binned in a uniform grid of cells one average wire long
+    that is kept from batch to batch, so a new batch is only tested 
+    against the wires in the cells it covers. Connectivity is tracked with
+    a union-find of the components, and the new wires are merged one at a 
+    time, so the network stops at the exact wire that connects the two 
+    regions (or reaches the density) and the wires after it in the batch 
+    are dropped.
+
+    Parameters
+    ----------
+    wire_av_length, wire_dispersion, Lx, Ly, this_seed : 
+        as in generate_wires_distribution. The network depends on 
+        this_seed and batch_size.
+    batch_size : int
+        Number of wires dropped at a time
+    max_wires : int
+        Give up after this many wires, defaults to 20 wires per average 
+        wire length squared, well above the percolation threshold of
+        about 5.6
+    source_region, drain_region : tuple
+        (xmin, xmax, ymin, ymax) in mum. A wire belongs to a region if one 
+        of its ends or its centre is inside it. Default to strips of one
+        average wire length along the left and right sides of the device.
+        Set both to None together with target_density to stop on density 
+        only.
+    target_density : float
+        Stop once there are this many junctions per mum^2
+
+    Returns
+    -------
+    dict
+        The keys of generate_wires_distribution and detect_junctions, plus
+        `percolating`, True when the source and drain regions are connected.
+        Use generate_graph and select_largest_component as usual.
+    '''
+    if source_region is None and drain_region is None and target_density is None:
+        source_region = (0.0, wire_av_length, 0.0, Ly)
+        drain_region  = (Lx - wire_av_length, Lx, 0.0, Ly)
+    if max_wires is None:
+        max_wires = int(np.ceil(20 * Lx * Ly / wire_av_length**2))
+    check_regions = source_region is not None and drain_region is not None
+
+    np.random.seed(this_seed)
+
+    # Persistent grid over the device, wires sticking out of it go to the
+    # border cells
+    cell_size = wire_av_length
+    nx_cells = max(int(np.ceil(Lx / cell_size)), 1)
+    ny_cells = max(int(np.ceil(Ly / cell_size)), 1)
+    grid_cell = np.zeros(0, dtype=np.int64) # sorted
+    grid_wire = np.zeros(0, dtype=np.int64)
+
+    xa, ya, xb, yb, xc, yc, theta = [np.zeros(0) for _ in range(7)]
+    edge_list = np.zeros((0, 2), dtype=np.int64)
+    xi, yi = np.zeros(0), np.zeros(0)
+    sets = UnionFind()
+    percolating = False
+    number_of_wires = 0
+
+    while number_of_wires < max_wires:
+        n = min(batch_size, max_wires - number_of_wires)
+        first = number_of_wires
+
+        # Same distributions as generate_wires_distribution
+        wire_lengths = generate_dist_lengths(n, wire_av_length, wire_dispersion)
+        bxc, byc = np.random.rand(n) * Lx, np.random.rand(n) * Ly
+        btheta = generate_dist_orientations(n)
+        bxa, bya = bxc - wire_lengths/2.0 * np.cos(btheta), byc - wire_lengths/2.0 * np.sin(btheta)
+        bxb, byb = bxc + wire_lengths/2.0 * np.cos(btheta), byc + wire_lengths/2.0 * np.sin(btheta)
+
+        # Cells covered by the box of every new wire
+        ix0 = np.clip(np.floor(np.minimum(bxa, bxb) / cell_size).astype(np.int64), 0, nx_cells - 1)
+        ix1 = np.clip(np.floor(np.maximum(bxa, bxb) / cell_size).astype(np.int64), 0, nx_cells - 1)
+        iy0 = np.clip(np.floor(np.minimum(bya, byb) / cell_size).astype(np.int64), 0, ny_cells - 1)
+        iy1 = np.clip(np.floor(np.maximum(bya, byb) / cell_size).astype(np.int64), 0, ny_cells - 1)
+        wx, wy = ix1 - ix0 + 1, iy1 - iy0 + 1
+        count = wx * wy
+        wire = np.repeat(np.arange(first, first + n), count)
+        local = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        cell = (np.repeat(iy0, count) + local // np.repeat(wx, count)) * nx_cells + \
+               np.repeat(ix0, count) + local % np.repeat(wx, count)
+
+        # Candidates against the wires in place: every grid entry of the 
+        # cells the new wires cover
+        lo = np.searchsorted(grid_cell, cell, side='left')
+        hi = np.searchsorted(grid_cell, cell, side='right')
+        hits = hi - lo
+        new = np.repeat(wire, hits)
+        old = grid_wire[np.repeat(lo, hits) + np.arange(hits.sum()) - np.repeat(np.cumsum(hits) - hits, hits)]
+        keys = np.unique(old * max_wires + new)
+        pairs = np.column_stack([keys // max_wires, keys % max_wires])
+        # and within the batch
+        pairs = np.concatenate([pairs, first + find_candidate_pairs(bxa, bya, bxb, byb, cell_size=cell_size)])
+
+        # Add the batch to the grid, keeping it sorted by cell
+        grid_cell = np.concatenate([grid_cell, cell])
+        grid_wire = np.concatenate([grid_wire, wire])
+        order = np.argsort(grid_cell, kind='stable')
+        grid_cell, grid_wire = grid_cell[order], grid_wire[order]
+
+        xa, ya, xb, yb = [np.concatenate(p) for p in [(xa, bxa), (ya, bya), (xb, bxb), (yb, byb)]]
+        xc, yc, theta  = [np.concatenate(p) for p in [(xc, bxc), (yc, byc), (theta, btheta)]]
+        number_of_wires += n
+
+        i, j = pairs[:, 0], pairs[:, 1]
+        found, x, y = find_segment_intersections(np.column_stack([xa[i], ya[i]]),
+                                                 np.column_stack([xb[i], yb[i]]),
+                                                 np.column_stack([xa[j], ya[j]]),
+                                                 np.column_stack([xb[j], yb[j]]))
+        # Junctions in the order their later wire was dropped
+        pairs, x, y = pairs[found], x[found], y[found]
+        order = np.lexsort((pairs[:, 0], pairs[:, 1]))
+        pairs, x, y = pairs[order], x[order], y[order]
+
+        if check_regions:
+            source = in_region(bxa, bya, source_region) | in_region(bxb, byb, source_region) | in_region(bxc, byc, source_region)
+            drain  = in_region(bxa, bya, drain_region)  | in_region(bxb, byb, drain_region)  | in_region(bxc, byc, drain_region)
+        else:
+            source = drain = np.zeros(n, dtype=bool)
+        sets.add(source, drain)
+
+        # Merge the new wires one by one to find where to stop
+        stop = None
+        start = np.searchsorted(pairs[:, 1], np.arange(first, first + n + 1))
+        for k, this_wire in enumerate(range(first, first + n)):
+            junctions = len(edge_list) + start[k + 1]
+            for e in range(start[k], start[k + 1]):
+                sets.union(pairs[e, 0], this_wire)
+            if check_regions and sets.percolates(this_wire):
+                percolating = True
+                stop = this_wire
+            elif target_density is not None and junctions >= target_density * Lx * Ly:
+                stop = this_wire
+            if stop is not None:
+                break
+
+        if stop is not None:
+            keep = pairs[:, 1] <= stop
+            pairs, x, y = pairs[keep], x[keep], y[keep]
+            number_of_wires = stop + 1
+            xa, ya, xb, yb, xc, yc, theta = [v[:number_of_wires] for v in (xa, ya, xb, yb, xc, yc, theta)]
+        edge_list = np.concatenate([edge_list, pairs])
+        xi, yi = np.concatenate([xi, x]), np.concatenate([yi, y])
+        if stop is not None:
+            break
+
+    logging.info('Grew %d wires with %d junctions, percolating: %s', number_of_wires, len(edge_list), percolating)
+
+    # Sort the junctions like detect_junctions does
+    order = np.lexsort((edge_list[:, 1], edge_list[:, 0]))
+
+    # Find values outside the domain
+    a = np.where(np.vstack([xa, xb, ya, yb]) < 0.0, True, False).sum(axis=0)
+    b = np.where(np.vstack([xa, xb]) > Lx, True, False).sum(axis=0)
+    c = np.where(np.vstack([ya, yb]) > Ly, True, False).sum(axis=0)
+
+    return dict(xa=xa,ya=ya,
+                xc=xc,yc=yc,
+                xb=xb,yb=yb,
+                theta=theta,
+                avg_length = wire_av_length,
+                dispersion = wire_dispersion,
+                centroid_dispersion = 0,
+                gennorm_shape = 0,
+                this_seed = this_seed,
+                outside = a + b + c,
+                length_x = Lx,
+                length_y = Ly,
+                number_of_wires = number_of_wires,
+                number_of_junctions = len(edge_list),
+                edge_list = edge_list[order],
+                xi = xi[order],
+                yi = yi[order],
+                percolating = percolating,
+                oldNameConvention = oldNameConvention)
+
+
 def save_obj(obj, name):
     """
     Save dictionary.
@@ -631,7 +1029,156 @@ def load_obj(name):
 
 
 
-def export_to_matlab(wires_dict, filename=None, save_pkl=False, folder = 'connectivity_data'):
+# Functions whose source is part of the cache key, so that changing any
+# step of the generation invalidates the cached networks
+_generator_functions = ['generate_wires_distribution', 'generate_dist_centroids', 
+                        'generate_dist_lengths', 'generate_dist_orientations',
+                        'find_candidate_pairs', 'find_segment_intersections', 
+                        'detect_junctions', 'generate_adj_matrix', 'generate_graph',
+                        'check_connectedness', 'select_largest_component']
+
+
+def network_cache_key(**params):
+    """
+    Key of a generated network: a hash of the generator parameters and of 
+    the source code of the generator.
+    """
+    import json
+    import hashlib
+    import inspect
+
+    code = ''.join(inspect.getsource(globals()[name]) for name in _generator_functions)
+    code_version = hashlib.sha1(code.encode()).hexdigest()
+    # 100, 100.0 and np.int64(100) generate the same network
+    params = {key: value if isinstance(value, bool) else float(value) 
+              for key, value in params.items()}
+    text = json.dumps(dict(params, code_version=code_version), sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def generate_network(number_of_wires=1500, 
+                     wire_av_length=14.0, 
+                     wire_dispersion=5.0,
+                     centroid_dispersion=1200.0,  
+                     gennorm_shape = 5,
+                     Lx=3e3, Ly=3e3, 
+                     this_seed=42,
+                     oldNameConvention = False,
+                     cache_dir=None,
+                     max_cache_bytes=2**30):
+    """
+    Drop the wires, detect the junctions, build the graph and keep the 
+    largest connected component, i.e. generate_wires_distribution, 
+    detect_junctions, generate_graph and select_largest_component in a row.
+
+    Parameters
+    ----------
+
+    cache_dir: str
+        Directory of previously generated networks. The result is stored
+        there under network_cache_key of the parameters, and a later call
+        with the same parameters (and unchanged generator code) loads it 
+        instead of generating it again. None disables the cache.
+
+    max_cache_bytes: int
+        Size limit of cache_dir. The least recently used networks are 
+        removed when a new one would exceed it.
+
+    Returns
+    ------- 
+    wires_dict: dict
+        The network, as returned by select_largest_component.
+    """
+    import os
+
+    params = dict(number_of_wires=number_of_wires, wire_av_length=wire_av_length,
+                  wire_dispersion=wire_dispersion, centroid_dispersion=centroid_dispersion,
+                  gennorm_shape=gennorm_shape, Lx=Lx, Ly=Ly, this_seed=this_seed,
+                  oldNameConvention=oldNameConvention)
+
+    if cache_dir is not None:
+        pathfile = os.path.join(cache_dir, network_cache_key(**params) + '.pkl')
+        if os.path.isfile(pathfile):
+            logging.info('Loading cached network %s', pathfile)
+            with open(pathfile, 'rb') as f:
+                wires_dict = pickle.load(f)
+            # mark as recently used
+            os.utime(pathfile)
+            # The graph is not stored, it is cheap to rebuild
+            return generate_graph(wires_dict)
+
+    wires_dict = generate_wires_distribution(**params)
+    wires_dict = detect_junctions(wires_dict)
+    wires_dict = generate_graph(wires_dict)
+    if not check_connectedness(wires_dict):
+        wires_dict = select_largest_component(wires_dict)
+
+    if cache_dir is not None:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        # write under a temporary name so concurrent readers never see a 
+        # partial file
+        tmpfile = '%s.%d.tmp' % (pathfile, os.getpid())
+        with open(tmpfile, 'wb') as f:
+            pickle.dump(remove_key(wires_dict, 'G'), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpfile, pathfile)
+        evict_network_cache(cache_dir, max_cache_bytes)
+
+    return wires_dict
+
+
+def evict_network_cache(cache_dir, max_cache_bytes):
+    """
+    Remove the least recently used networks of cache_dir until its size 
+    is at most max_cache_bytes. The most recent one is always kept.
+    """
+    import os
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.pkl'):
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+    entries.sort()
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in entries[:-1]:
+        if total <= max_cache_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+        logging.info('Removed %s from the network cache', name)
+
+
+def network_filename(wires_dict):
+    """
+    File name (without extension) of a network, see export_to_matlab.
+    """
+    timestamp = time.strftime("%Y-%m-%d-%H%M%S")
+    nw   = wires_dict['number_of_wires']
+    nj   = wires_dict['number_of_junctions']
+    avl  = wires_dict['avg_length']
+    disp = wires_dict['dispersion']
+    seed = wires_dict['this_seed'] 
+    Lx = wires_dict['length_x']
+    Ly = wires_dict['length_y']
+    if wires_dict.get('oldNameConvention') is True:
+        gns = wires_dict['gennorm_shape']
+        cdisp = wires_dict['centroid_dispersion']
+        pars_values = '_asn_nw_%05d_nj_%05d_seed_%03d_avl_%05.2f_disp_%05.2f_gns_%05.2f_cdisp_%05.2f' % (nw, nj, seed, avl, disp, gns, cdisp)
+        return timestamp + pars_values
+    return 'asn_nw_%05d_nj_%05d_seed_%03d_avl_%05.2f_disp_%05.2f_lx_%05.2f_ly_%05.2f' % (nw, nj, seed, avl, disp, Lx, Ly)
+
+
+def export_to_matlab(wires_dict, filename=None, save_pkl=False, folder = 'connectivity_data',
+                     wire_distances='dense', distance_radius=None, adj_matrix='dense'):
     """
     This exports the dictionary into a matlab file.
     File name convention is as follows:
@@ -646,26 +1193,19 @@ def export_to_matlab(wires_dict, filename=None, save_pkl=False, folder = 'connec
     disp : dispersion of nanowires lengths
     gns  : gennorm shape parameter (beta)
     cdisp: centroid dispersion (scale of gennorm_shape) 
+
+    wire_distances controls the wire_distances variable of the file:
+    'dense' writes the full matrix (what getConnectivity.m loads),
+    'sparse' only the distances up to distance_radius as a sparse matrix,
+    None leaves it out.
+
+    adj_matrix is written as a full matrix by default, which is what the
+    MATLAB and python simulators expect; 'sparse' keeps it sparse.
     """
     # Generate a meaningful name
 
     if filename is None:
-        timestamp = time.strftime("%Y-%m-%d-%H%M%S")
-        nw   = wires_dict['number_of_wires']
-        nj   = wires_dict['number_of_junctions']
-        avl  = wires_dict['avg_length']
-        disp = wires_dict['dispersion']
-        seed = wires_dict['this_seed'] 
-        Lx = wires_dict['length_x']
-        Ly = wires_dict['length_y']
-        if wires_dict['oldNameConvention'] is True:
-            gns = wires_dict['gennorm_shape']
-            cdisp = wires_dict['centroid_dispersion']
-            pars_values = '_asn_nw_%05d_nj_%05d_seed_%03d_avl_%05.2f_disp_%05.2f_gns_%05.2f_cdisp_%05.2f' % (nw, nj, seed, avl, disp, gns, cdisp)
-            filename = timestamp + pars_values
-        else: 
-            filename = 'asn_nw_%05d_nj_%05d_seed_%03d_avl_%05.2f_disp_%05.2f_lx_%05.2f_ly_%05.2f' % (nw, nj, seed, avl, disp, Lx, Ly)
-        
+        filename = network_filename(wires_dict)
         
 
     # Save the dictionary for later use in python
@@ -675,6 +1215,20 @@ def export_to_matlab(wires_dict, filename=None, save_pkl=False, folder = 'connec
     # Remove key:value that savemat does not understand
     temp_dict = remove_key(wires_dict, 'G')
 
+    if adj_matrix == 'dense':
+        temp_dict['adj_matrix'] = wires_dict['adj_matrix'].toarray()
+    elif adj_matrix != 'sparse':
+        raise ValueError('adj_matrix must be \'dense\' or \'sparse\'')
+
+    if wire_distances == 'dense':
+        temp_dict['wire_distances'] = compute_wire_distances(wires_dict)
+    elif wire_distances == 'sparse':
+        if distance_radius is None:
+            raise ValueError('wire_distances=\'sparse\' needs a distance_radius')
+        temp_dict['wire_distances'] = compute_wire_distances(wires_dict, radius=distance_radius)
+    elif wire_distances is not None:
+        raise ValueError('wire_distances must be \'dense\', \'sparse\' or None')
+
     # Save to mat format
     import os
     
@@ -686,8 +1240,94 @@ def export_to_matlab(wires_dict, filename=None, save_pkl=False, folder = 'connec
     print('Saved to: ', pathfile)
     savemat(pathfile, temp_dict)
     
-    return
+    return pathfile
+
+
 
+# Keys that are not written to the binary format: the graph object and the 
+# matrices that are derived from the other columns
+_network_skip_keys = ['G', 'adj_matrix', 'wire_distances']
+
+
+def export_to_network(wires_dict, filename=None, folder='connectivity_data'):
+    """
+    This exports the dictionary into the compact binary network format, 
+    a directory <filename>.nwn holding
+
+        header.json   the scalar keys (number_of_wires, avg_length, ...) 
+                      and the name, dtype and shape of every column
+        <key>.npy     one array per column: wire end points and centres,
+                      edge_list (int32), junction coordinates xi, yi, ...
+
+    Every column can be memory-mapped with np.load(..., mmap_mode='r'), 
+    so loading a network reads only the header. adj_matrix is not stored,
+    it follows from edge_list. File names follow export_to_matlab.
+
+    Returns
+    ------- 
+    pathfile: str
+        The path of the .nwn directory.
+    """
+    import os
+    import json
+
+    if filename is None:
+        filename = network_filename(wires_dict)
+    pathfile = os.path.join(folder, filename + '.nwn')
+    if not os.path.exists(pathfile):
+        os.makedirs(pathfile)
+
+    header = dict(format='nwn', version=1, scalars={}, columns={})
+    for key, value in wires_dict.items():
+        if key in _network_skip_keys:
+            continue
+        if isinstance(value, np.ndarray) and value.ndim > 0:
+            if key == 'edge_list':
+                value = value.astype(np.int32).reshape(-1, 2)
+            value = np.ascontiguousarray(value)
+            np.save(os.path.join(pathfile, key + '.npy'), value)
+            header['columns'][key] = dict(dtype=value.dtype.str, shape=list(value.shape))
+        elif isinstance(value, (bool, int, float, str, np.generic, np.ndarray)):
+            # numpy scalars and 0-d arrays become plain numbers
+            header['scalars'][key] = value.item() if hasattr(value, 'item') else value
+
+    # header last: a directory with a header is complete
+    with open(os.path.join(pathfile, 'header.json'), 'w') as f:
+        json.dump(header, f, indent=1, sort_keys=True)
+
+    print('Saved to: ', pathfile)
+    return pathfile
+
+
+def mat_to_network(mat_file, folder=None):
+    """
+    Convert a .mat file written by export_to_matlab to the binary network 
+    format, next to it unless folder is given. Returns the .nwn path.
+    """
+    import os
+    from scipy.io import loadmat
+
+    matfile = loadmat(mat_file, squeeze_me=True)
+    per_wire = ['xa', 'ya', 'xb', 'yb', 'xc', 'yc', 'theta', 'outside']
+    per_junction = ['xi', 'yi']
+
+    wires_dict = {}
+    for key, value in matfile.items():
+        if key[0:2] == '__' or key in _network_skip_keys:
+            continue
+        # squeeze_me turns length-1 columns into scalars
+        if key in per_wire + per_junction:
+            value = np.atleast_1d(value)
+        elif key == 'edge_list':
+            value = np.asarray(value).reshape(-1, 2)
+        elif isinstance(value, np.ndarray) and value.dtype.kind == 'U':
+            value = str(value)
+        wires_dict[key] = value
+
+    if folder is None:
+        folder = os.path.dirname(mat_file)
+    filename = os.path.splitext(os.path.basename(mat_file))[0]
+    return export_to_network(wires_dict, filename=filename, folder=folder)
 
 
 def draw_wires(ax, wires_dict):
@@ -75,20 +75,19 @@ class equations__:
         Need to generate a (E+1) x (E+1) coefficient matrix.
         First V-1 equations based on Kirchoff's current law. 
         Sum of currents in junctions on the sum nanowire should be zero.
+        KCL and KVL are returned as scipy.sparse CSR matrices.
         """
+        from scipy.sparse import csr_matrix
 
         V = connectivity.numOfWires
         E = connectivity.numOfJunctions
-        edgeList = connectivity.edge_list
+        edgeList = np.asarray(connectivity.edge_list).astype(int)
 
-        KCLmat = np.zeros((V,E+1))
-        for this_wire in range(V):
-            junction_ind, flow = np.where(edgeList == this_wire)
-            for i in range(len(junction_ind)):
-                KCLmat[this_wire, junction_ind[i]] = (flow[i] - 0.5)*2 
-
-        KCLmat[contactWires[0], -1] = 1
-        KCLmat[contactWires[1], -1] = -1
+        junctions = np.arange(E)
+        rows = np.concatenate([edgeList[:,0], edgeList[:,1], contactWires])
+        cols = np.concatenate([junctions, junctions, [E, E]])
+        vals = np.concatenate([-np.ones(E), np.ones(E), [1, -1]])
+        KCLmat = csr_matrix((vals, (rows, cols)), shape=(V,E+1))
 
         """
         E-V+2 equations based on Kirchoff's voltage law.
@@ -97,37 +96,81 @@ class equations__:
         When have multiple electrodes, just include more equations.
         """
 
-        KVLmat = np.zeros((E-V+2,E+1))
         G = nx.from_numpy_array(connectivity.adj_matrix)
         cycles = nx.cycle_basis(G)
         extCycle = nx.shortest_path(G, contactWires[1], contactWires[0])
         extCycle.append(V+1)
         cycles.append(extCycle)
         edgeList = np.append(edgeList, np.array([[contactWires[1], V+1]]), axis = 0)
-        row_count = 0
-        for this_cycle in cycles:
-            temp_cycle = np.array(this_cycle)
-            temp_cycle = np.append(temp_cycle, this_cycle[0])
-
-            from_vertex = temp_cycle[0:-1]
-            to_vertex = temp_cycle[1:]
-            direc = ((from_vertex > to_vertex)-0.5)*2
-            
-            for i in range(direc.size):
-                if not ((from_vertex[i] == contactWires[0]) and (to_vertex[i] == V+1)):
-                    edge_pos = np.where((edgeList[:,0]==from_vertex[i])&(edgeList[:,1]==to_vertex[i]))[0]
-                    if edge_pos.size != 0:
-                        edge_index = edge_pos[0]
-                    else: 
-                        edge_index = np.where((edgeList[:,1]==from_vertex[i])&(edgeList[:,0]==to_vertex[i]))[0][0]
-                KVLmat[row_count, edge_index] = direc[i]
-            row_count += 1
+
+        # every step (from, to) of every closed cycle, one row per cycle
+        lengths = np.array([len(c) for c in cycles])
+        from_vertex = np.fromiter((v for c in cycles for v in c), dtype=int, count=lengths.sum())
+        row = np.repeat(np.arange(len(cycles)), lengths)
+        first = np.cumsum(lengths) - lengths
+        to_vertex = np.roll(from_vertex, -1)
+        to_vertex[first + lengths - 1] = from_vertex[first]
+        direc = ((from_vertex > to_vertex)-0.5)*2
+
+        # junction index of each step from a sorted hash of the edges
+        N = V+2
+        keys = np.minimum(edgeList[:,0], edgeList[:,1])*N + np.maximum(edgeList[:,0], edgeList[:,1])
+        order = np.argsort(keys)
+        stepKeys = np.minimum(from_vertex, to_vertex)*N + np.maximum(from_vertex, to_vertex)
+        edge_index = order[np.minimum(np.searchsorted(keys[order], stepKeys), E)]
+
+        # The source step (contactWires[0] -> V+1) is no junction. The loop
+        # this replaces wrote its coefficient onto the previous step's
+        # junction, so do the same.
+        source = np.flatnonzero((from_vertex == contactWires[0]) & (to_vertex == V+1))
+        edge_index[source] = edge_index[source-1]
+        keep = np.ones(from_vertex.size, dtype=bool)
+        keep[source-1] = False
+
+        KVLmat = csr_matrix((direc[keep], (row[keep], edge_index[keep])), shape=(E-V+2,E+1))
 
         self.KCL = KCLmat[0:-1,:]
         self.KVL = KVLmat
 
     pass    
 
+class kirchhoffSystem__:
+    def __init__(self, equations, useSparse = False):
+        """
+        lhs = [KCL/resistance; KVL], kept between steps. Only the KCL
+        block depends on the resistances. In the sparse form its entries
+        are rescaled in place in the CSC data array, the KVL block and the
+        sparsity pattern never change, and the LU factors are reused until
+        a resistance changes.
+        """
+        self.useSparse = useSparse
+        self.numOfKCL = equations.KCL.shape[0]
+        self.resistance = None
+        if useSparse:
+            from scipy.sparse import vstack
+            self.lhs = vstack([equations.KCL, equations.KVL]).tocsc()
+            self.kclSlots = np.flatnonzero(self.lhs.indices < self.numOfKCL)
+            self.kclCols = np.repeat(np.arange(self.lhs.shape[1]), np.diff(self.lhs.indptr))[self.kclSlots]
+            self.kclVals = self.lhs.data[self.kclSlots].copy()
+        else:
+            self.KCL = equations.KCL.toarray()
+            self.lhs = np.vstack((self.KCL, equations.KVL.toarray()))
+        self.rhs = np.zeros(self.lhs.shape[0])
+
+    def solve(self, resistance, source):
+        if self.resistance is None or np.any(resistance != self.resistance):
+            self.resistance = resistance.copy()
+            if self.useSparse:
+                from scipy.sparse.linalg import splu
+                self.lhs.data[self.kclSlots] = self.kclVals/resistance[self.kclCols]
+                self.lu = splu(self.lhs)
+            else:
+                np.divide(self.KCL, resistance, out = self.lhs[0:self.numOfKCL])
+        self.rhs[-1] = source
+        if self.useSparse:
+            return self.lu.solve(self.rhs)
+        return np.linalg.solve(self.lhs, self.rhs)
+
 def simulateNetwork(simulationOptions, connectivity, junctionState, 
                     stimulus, equations, 
                     simpleOutput = False,
@@ -137,23 +180,12 @@ def simulateNetwork(simulationOptions, connectivity, junctionState,
     E = connectivity.numOfJunctions
     V = connectivity.numOfWires
     testerVoltage = np.zeros(niterations)
-    rhs = np.zeros((E+1,1))
-    if useSparse:
-        from scipy.sparse import csc_matrix
-        from scipy.sparse.linalg import spsolve
+    system = kirchhoffSystem__(equations, useSparse = useSparse)
 
     if simpleOutput: 
         for i in tqdm(range(niterations), desc='Running Simulation '):
             junctionState.updateResistance()
-            Rmat = np.ones((V-1,1))*junctionState.resistance
-            lhs = np.vstack((equations.KCL/Rmat, equations.KVL)) 
-            rhs[-1,0] = stimulus.signal[i]
-            if useSparse:
-                LHS = csc_matrix(lhs)
-                RHS = csc_matrix(rhs)
-                junctionState.voltage = spsolve(LHS, RHS)
-            else: 
-                junctionState.voltage = np.linalg.solve(lhs, rhs[:,0])
+            junctionState.voltage = system.solve(junctionState.resistance, stimulus.signal[i])
                 
             junctionState.updateJunctionState(simulationOptions.dt)
             testerVoltage[i] = junctionState.voltage[-1]
@@ -175,15 +207,7 @@ def simulateNetwork(simulationOptions, connectivity, junctionState,
 
         for i in tqdm(range(niterations), desc='Running Simulation '):
             junctionState.updateResistance()
-            Rmat = np.ones((V-1,1))*junctionState.resistance
-            lhs = np.vstack((equations.KCL/Rmat, equations.KVL)) 
-            rhs[-1,0] = stimulus.signal[i]
-            if useSparse:
-                LHS = csc_matrix(lhs)
-                RHS = csc_matrix(rhs)
-                junctionState.voltage = spsolve(LHS, RHS)
-            else: 
-                junctionState.voltage = np.linalg.solve(lhs, rhs[:,0])
+            junctionState.voltage = system.solve(junctionState.resistance, stimulus.signal[i])
 
             junctionState.updateJunctionState(simulationOptions.dt)
             testerVoltage[i] = junctionState.voltage[-1]
@@ -203,8 +227,8 @@ def simulateNetwork(simulationOptions, connectivity, junctionState,
         Network.networkCurrent = testerVoltage/junctionState.resistance[-1]
         Network.networkResistance = (stimulus.signal/testerVoltage-1)*junctionState.resistance[-1]
         Network.junctionList = np.add(connectivity.edge_list, 1).T
-        Network.KVL = equations.KCL[:,0:-1]
-        Network.KVL = equations.KVL[:,0:-1]
+        Network.KVL = equations.KCL[:,0:-1].toarray()
+        Network.KVL = equations.KVL[:,0:-1].toarray()
         # Network.LHS = lhs
         # Network.RHS = rhs
         Network.connectivity = connectivity
@@ -217,7 +241,7 @@ def simulateNetwork_Lite(simulationOptions,
     E = connectivity.numOfJunctions
     V = connectivity.numOfWires
     testerVoltage = np.zeros(niterations)
-    rhs = np.zeros((E+1,1))
+    system = kirchhoffSystem__(equations)
 
     import dataStruct 
     Network = dataStruct.network__()
@@ -228,10 +252,7 @@ def simulateNetwork_Lite(simulationOptions,
 
     for i in tqdm(range(niterations), desc='Running Simulation '):
         junctionState.updateResistance()
-        Rmat = np.ones((V-1,1))*junctionState.resistance
-        lhs = np.vstack((equations.KCL/Rmat, equations.KVL)) 
-        rhs[-1,0] = stimulus.signal[i]
-        junctionState.voltage = np.linalg.solve(lhs, rhs[:,0])
+        junctionState.voltage = system.solve(junctionState.resistance, stimulus.signal[i])
 
         junctionState.updateJunctionState(simulationOptions.dt)
         testerVoltage[i] = junctionState.voltage[-1]
@@ -251,8 +272,8 @@ def simulateNetwork_Lite(simulationOptions,
     Network.networkCurrent = testerVoltage/junctionState.resistance[-1]
     Network.networkResistance = (stimulus.signal/testerVoltage-1)*junctionState.resistance[-1]
     Network.junctionList = np.add(connectivity.edge_list, 1).T
-    Network.KVL = equations.KCL[:,0:-1]
-    Network.KVL = equations.KVL[:,0:-1]
+    Network.KVL = equations.KCL[:,0:-1].toarray()
+    Network.KVL = equations.KVL[:,0:-1].toarray()
     # Network.LHS = lhs
     # Network.RHS = rhs
     Network.connectivity = connectivity
@@ -0,0 +1,73 @@
+from utils import junctionState__
+from junctionKernels import numba
+import time
+import numpy as np
+"""
+Per step cost of the junction state update (updateResistance followed by
+updateJunctionState) at 10k-100k junctions: the original expressions
+against the in-place kernels of junctionKernels.py, numpy and, when it is
+installed, numba. Also checks, after every step, that each backend gives
+the same filament states, resistances and on/off masks as the original.
+"""
+
+def originalStep(junctionState, dt):
+    s = junctionState
+    s.OnOrOff = abs(s.filamentState) >= s.critialFlux
+    s.resistance = s.offResistance + (s.onResistance-s.offResistance)*s.OnOrOff
+    s.filamentState = s.filamentState + \
+                        (abs(s.voltage) > s.setVoltage) *\
+                        (abs(s.voltage) - s.setVoltage) *\
+                        np.sign(s.voltage) * dt
+    s.filamentState = s.filamentState - \
+                        (abs(s.voltage) < s.resetVoltage) *\
+                        (s.resetVoltage - abs(s.voltage)) *\
+                        np.sign(s.filamentState) * dt * 10
+    maxPosition = abs(s.filamentState) > s.maxFlux
+    s.filamentState[maxPosition] = np.sign(s.filamentState[maxPosition]) * s.maxFlux
+
+def kernelStep(junctionState, dt):
+    junctionState.updateResistance()
+    junctionState.updateJunctionState(dt)
+
+def sameSteps(backend, voltages, dt):
+    reference = junctionState__(voltages[0].size)
+    junctionState = junctionState__(voltages[0].size, backend = backend)
+    for voltage in voltages:
+        reference.voltage = voltage
+        junctionState.voltage = voltage
+        originalStep(reference, dt)
+        kernelStep(junctionState, dt)
+        for field in ['filamentState', 'resistance', 'OnOrOff']:
+            if not np.array_equal(getattr(junctionState, field), getattr(reference, field)):
+                return False
+    return True
+
+def timeSteps(step, junctionState, voltages, dt):
+    step(junctionState, dt)     # warm up (and compile)
+    start = time.perf_counter()
+    for voltage in voltages:
+        junctionState.voltage = voltage
+        step(junctionState, dt)
+    return (time.perf_counter() - start)/len(voltages)
+
+if __name__ == '__main__':
+    dt = 1e-3
+    numOfSteps = 200
+    backends = ['numpy'] + (['numba'] if numba is not None else [])
+    print('%10s %14s' % ('junctions', 'original') +
+            ''.join('%14s %8s' % (backend, 'speedup') for backend in backends))
+    for E in [10000, 30000, 100000]:
+        rng = np.random.default_rng(0)
+        # a mix of junctions growing, decaying and saturating
+        voltages = [rng.normal(0, 0.5, E)*(rng.random(E) < 0.7) for i in range(numOfSteps)]
+
+        reference = junctionState__(E)
+        original = timeSteps(originalStep, reference, voltages, dt)
+        line = '%10d %11.1f us' % (E, original*1e6)
+        for backend in backends:
+            junctionState = junctionState__(E, backend = backend)
+            kernel = timeSteps(kernelStep, junctionState, voltages, dt)
+            if not sameSteps(backend, voltages, dt):
+                print('%s kernel differs from the original update.' % backend)
+            line += '%11.1f us %7.1fx' % (kernel*1e6, original/kernel)
+        print(line)
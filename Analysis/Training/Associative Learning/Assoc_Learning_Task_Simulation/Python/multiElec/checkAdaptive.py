@@ -0,0 +1,61 @@
+from utils import simulation_options__, stimulus__, junctionState__, simulateNetworkPlus
+from integrators import simulateNetworkAdaptive
+import sys
+import numpy as np
+from scipy.spatial import cKDTree
+"""
+Regression check of simulateNetworkAdaptive against simulateNetworkPlus:
+on a random network driven by a DC pulse, every junction has to switch on
+and off on the same steps of the simulationOptions.dt grid, and the wire
+voltages have to agree. Exits with status 1 if they do not.
+"""
+
+class randomConnectivity__:
+    """
+    Wires at random points, joined when closer than the radius giving
+    about junctionsPerWire junctions each, plus a chain in x so the
+    network is connected.
+    """
+    def __init__(self, numOfWires, junctionsPerWire=5, seed=0):
+        rng = np.random.default_rng(seed)
+        points = rng.random((numOfWires, 2))
+        radius = np.sqrt(junctionsPerWire/(np.pi*numOfWires))
+        edges = set(map(tuple, cKDTree(points).query_pairs(radius, output_type='ndarray').tolist()))
+        order = np.argsort(points[:,0])
+        edges |= set(tuple(sorted((int(a), int(b)))) for a, b in zip(order[:-1], order[1:]))
+        self.edge_list = np.array(sorted(edges))
+        self.numOfWires = self.number_of_wires = numOfWires
+        self.numOfJunctions = self.number_of_junctions = len(edges)
+        self.adj_matrix = np.zeros((numOfWires, numOfWires))
+        self.adj_matrix[self.edge_list[:,0], self.edge_list[:,1]] = 1
+        self.adj_matrix += self.adj_matrix.T
+
+def switchSteps(junctionSwitch):
+    changes = np.diff(junctionSwitch.astype(int), axis=0)
+    return [tuple(int(step) for step in np.flatnonzero(changes[:,j])) for j in range(junctionSwitch.shape[1])]
+
+if __name__ == '__main__':
+    failed = False
+    for numOfWires, seed in [(244, 0), (400, 1)]:
+        connectivity = randomConnectivity__(numOfWires, seed = seed)
+        simulationOptions = simulation_options__(dt = 1e-3, T = 1, interfaceElectrodes = [1, 60])
+        simulationOptions.stimulus = [stimulus__(biasType = 'DC', TimeVector = simulationOptions.TimeVector,
+                                                onTime = 0.1, offTime = 0.6, onAmp = 2, offAmp = 0.005),
+                                      stimulus__(biasType = 'Drain', TimeVector = simulationOptions.TimeVector)]
+
+        fixed = simulateNetworkPlus(simulationOptions, connectivity,
+                                    junctionState__(connectivity.numOfJunctions))
+        adaptive = simulateNetworkAdaptive(simulationOptions, connectivity,
+                                            junctionState__(connectivity.numOfJunctions))
+
+        expected = switchSteps(fixed.junctionSwitch)
+        found = switchSteps(adaptive.junctionSwitch)
+        wrong = [j for j in range(len(expected)) if expected[j] != found[j]]
+        voltageError = np.abs(fixed.wireVoltage - adaptive.wireVoltage).max()
+        print('%d wires, %d junctions: %d switch, %d on other steps, wire voltages within %.1e V, %d of %d solves'
+                % (numOfWires, connectivity.numOfJunctions, sum(len(s) > 0 for s in expected),
+                    len(wrong), voltageError, adaptive.numOfSolves, simulationOptions.NumOfIterations))
+        for j in wrong[0:5]:
+            print('  junction %d switches on steps %s instead of %s' % (j, found[j], expected[j]))
+        failed |= len(wrong) > 0 or voltageError > 1e-9
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,164 @@
+"""
+Checkpoints of the simulator state, and a library of pre-formed states.
+
+saveCheckpoint writes a junctionState__ (filament states, on/off mask,
+resistances, voltages, thresholds and junction model) together with the
+time and the stimulus step it was taken at to one compressed .npz file;
+loadCheckpoint rebuilds it as a checkpoint__. The simulators continue from
+whatever junctionState__ they are given, so a loaded state warm-starts a
+run. step is the stimulus cursor, the index of the first stimulus sample
+not yet applied; passed as startStep to simulateNetworkPlus (or the
+integrators) it resumes the protocol there:
+    options = simulation_options__(dt = 1e-3, T = 10)   # whole protocol
+    options.stimulus = [stimulus__(..., TimeVector = options.TimeVector), ...]
+    first = simulation_options__(dt = 1e-3, T = 4)      # its first 4 s
+    first.stimulus = options.stimulus
+    simulateNetworkPlus(first, connectivity, junctionState)
+    saveCheckpoint('at4s.npz', junctionState, 4.0, first.NumOfIterations)
+    ...
+    checkpoint = loadCheckpoint('at4s.npz')
+    simulateNetworkPlus(options, connectivity, checkpoint.junctionState,
+                        startStep = checkpoint.step)
+
+stateLibrary__ keeps pre-formed states on disk, keyed by the connectivity
+(its edge list) and the formation protocol, a dictionary in the format of
+a sweep run (see sweep.py) without the filename:
+    library = stateLibrary__('preformed')
+    formation = dict(dt = 1e-3, T = 5, interfaceElectrodes = [73, 30],
+                     stimulus = [dict(biasType = 'DC', onTime = 0, offTime = 5, onAmp = 2),
+                                 dict(biasType = 'Drain')])
+    junctionState = library.get(connectivity, formation)
+The first call runs the formation with simulateNetworkPlus and stores the
+final state, every later call (any process) loads it. Sweep runs with a
+'formation' entry start from these states; runSweep forms each distinct
+formation once in the parent process before the runs are handed out.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+stateFields = ['filamentState', 'OnOrOff', 'resistance', 'voltage',
+                'onResistance', 'offResistance']
+
+class checkpoint__:
+    def __init__(self, junctionState, time=0.0, step=0, protocol=None):
+        self.junctionState = junctionState
+        self.time = time
+        self.step = step
+        self.protocol = protocol
+
+def modelName(model):
+    from junctionModels import junctionModels
+    for name, modelClass in junctionModels.items():
+        if type(model) is modelClass:
+            return name
+    raise ValueError('%s is not a registered junction model.' % type(model).__name__)
+
+def saveCheckpoint(path, junctionState, time=0.0, step=0, protocol=None):
+    """
+    Writes path (.npz) under a temporary name of this process first, so an
+    interrupted save never leaves a truncated checkpoint behind and
+    concurrent writers of the same checkpoint do not clash.
+    """
+    model = junctionState.model
+    header = dict(time = time, step = step,
+                    setVoltage = junctionState.setVoltage,
+                    resetVoltage = junctionState.resetVoltage,
+                    criticalFlux = junctionState.critialFlux,
+                    maxFlux = junctionState.maxFlux,
+                    model = modelName(model),
+                    modelParameters = vars(model),
+                    protocol = protocol)
+    arrays = {field: np.asarray(getattr(junctionState, field)) for field in stateFields}
+    tmpPath = '%s.%d.tmp.npz' % (path, os.getpid())
+    np.savez_compressed(tmpPath, header = json.dumps(header), **arrays)
+    os.replace(tmpPath, path)
+
+def loadCheckpoint(path):
+    from utils import junctionState__
+    from junctionModels import junctionModels
+
+    with np.load(path) as data:
+        header = json.loads(str(data['header']))
+        arrays = {field: data[field] for field in stateFields}
+    shape = arrays['filamentState'].shape
+    model = junctionModels[header['model']](**header['modelParameters'])
+    junctionState = junctionState__(shape[-1], batchSize = shape[0] if len(shape) == 2 else None,
+                                    setVoltage = header['setVoltage'],
+                                    resetVoltage = header['resetVoltage'],
+                                    criticalFlux = header['criticalFlux'],
+                                    maxFlux = header['maxFlux'],
+                                    model = model)
+    for field in stateFields:
+        setattr(junctionState, field, arrays[field])
+    return checkpoint__(junctionState, header['time'], header['step'], header['protocol'])
+
+def networkKey(connectivity):
+    edgeList = np.ascontiguousarray(connectivity.edge_list, dtype=np.int64)
+    digest = hashlib.sha1(edgeList.tobytes())
+    digest.update(str(connectivity.numOfWires).encode())
+    return digest.hexdigest()[0:16]
+
+class stateLibrary__:
+    def __init__(self, path='preformed', solver='dense'):
+        """
+        solver is used for formations that do not name their own, 'dense'
+        as in simulateNetworkPlus and the sweep runs.
+        """
+        self.path = path
+        self.solver = solver
+
+    def withSolver(self, protocol):
+        """
+        The protocol with the solver it is formed with, which is part of
+        the key: the solvers agree only to rounding.
+        """
+        protocol = dict(protocol)
+        protocol.setdefault('solver', self.solver)
+        return protocol
+
+    def key(self, connectivity, protocol):
+        protocol = self.withSolver(protocol)
+        text = networkKey(connectivity) + json.dumps(protocol, sort_keys=True, default=str)
+        return hashlib.sha1(text.encode()).hexdigest()[0:16]
+
+    def filename(self, connectivity, protocol):
+        return os.path.join(self.path, self.key(connectivity, protocol) + '.npz')
+
+    def __contains__(self, item):
+        return os.path.isfile(self.filename(*item))
+
+    def load(self, connectivity, protocol):
+        return loadCheckpoint(self.filename(connectivity, protocol))
+
+    def form(self, connectivity, protocol):
+        """
+        Run the formation protocol from a fresh junctionState__ and store
+        the final state, returns its checkpoint__.
+        """
+        from sweep import buildRun
+        from utils import simulateNetworkPlus
+        from recorder import recorder__
+
+        protocol = self.withSolver(protocol)
+        simulationOptions, junctionState = buildRun(protocol, connectivity)
+        simulateNetworkPlus(simulationOptions, connectivity, junctionState,
+                            solver = protocol['solver'],
+                            recorder = recorder__(fields = []))
+        step = simulationOptions.NumOfIterations
+        checkpoint = checkpoint__(junctionState, step*simulationOptions.dt, step, protocol)
+
+        os.makedirs(self.path, exist_ok = True)
+        saveCheckpoint(self.filename(connectivity, protocol), junctionState,
+                        checkpoint.time, checkpoint.step, protocol)
+        return checkpoint
+
+    def get(self, connectivity, protocol):
+        """
+        The pre-formed junctionState__, formed on the first request.
+        """
+        if (connectivity, protocol) in self:
+            return self.load(connectivity, protocol).junctionState
+        return self.form(connectivity, protocol).junctionState
@@ -0,0 +1,353 @@
+"""
+Variable step integrators for the atomic-switch network.
+
+simulateNetworkPlus takes simulationOptions.dt steps whatever the network
+does. simulateNetworkAdaptive takes simulationOptions.dt as the smallest
+step and lets it grow while the filament states barely move (saturated at
+maxFlux, decayed to zero, or drifting slowly below threshold). Steps are
+shrunk again so that threshold crossings are resolved to within dtMin, and
+never run past a change of the stimulus.
+
+Between steps the junction voltages are constant, so the forward Euler
+update of junctionState__ is exact there; the step size only controls
+where the solution is refreshed. The one exception is the reset decay,
+which would overshoot through zero on a long step. It is stopped at zero,
+where the fixed step simulation chatters around it instead.
+
+Step sizes are whole multiples of dtMin, so the accepted times stay on the
+dtMin grid and a crossing lands on the step on which simulateNetworkPlus
+switches the same junction.
+"""
+
+import numpy as np
+
+from tqdm import tqdm
+
+def stimulusBreakpoints(simulationOptions, numOfElectrodes):
+    signals = np.array([simulationOptions.stimulus[i].signal for i in range(numOfElectrodes)])
+    # the stimulus may run on past the end of this run
+    signals = signals[:, 0:simulationOptions.TimeVector.size]
+    changes = np.flatnonzero(np.any(np.diff(signals, axis=1) != 0, axis=0)) + 1
+    return signals, simulationOptions.TimeVector[changes]
+
+def simulateNetworkAdaptive(simulationOptions, connectivity, junctionState,
+                            solver = 'dense', dtMin = None, dtMax = None,
+                            fluxTol = None, resample = True, startStep = 0):
+    """
+    dtMin defaults to simulationOptions.dt, dtMax to 1000 dtMin and fluxTol
+    (the largest filament change allowed in one step) to 5% of the
+    critical flux. With resample = True the traces are returned on
+    simulationOptions.TimeVector like simulateNetworkPlus does, otherwise
+    on the accepted steps (Network.TimeVector, Network.stepSize).
+    startStep starts the run at TimeVector[startStep], as in
+    simulateNetworkPlus.
+    """
+    dt0 = simulationOptions.dt
+    dtMin = dt0 if dtMin is None else dtMin
+    dtMax = 1000*dtMin if dtMax is None else dtMax
+    fluxTol = 0.05*junctionState.critialFlux if fluxTol is None else fluxTol
+
+    electrodes = simulationOptions.electrodes
+    numOfElectrodes = len(electrodes)
+    edgeList = connectivity.edge_list
+    TimeVector = simulationOptions.TimeVector
+    endTime = TimeVector.size*dt0
+    signals, breakpoints = stimulusBreakpoints(simulationOptions, numOfElectrodes)
+
+    from mna import mnaSolver__
+    from junctionModels import solverOptions
+    engine = mnaSolver__(connectivity, electrodes, solver = solver, **solverOptions(junctionState))
+
+    record = dict(time = [], stepSize = [], wireVoltage = [], electrodeCurrent = [],
+                filamentState = [], junctionVoltage = [], junctionResistance = [],
+                junctionSwitch = [])
+    # steps are whole numbers of dtMin, counted in integers, so that the
+    # accepted times stay on the grid and crossings land on the step on
+    # which simulateNetworkPlus switches
+    startTime = startStep*dt0
+    t = startTime
+    elapsed = 0
+    k = 1
+    kMax = max(1, int(np.floor(dtMax/dtMin + 1e-6)))
+    lastElecVoltage = None
+    numOfSolves = 0
+    initialState = junctionState.filamentState.copy()
+    progress = tqdm(total = TimeVector.size, initial = startStep,
+                    desc = 'Running Adaptive Simulation ')
+    while t < endTime - 1e-9*dt0:
+        junctionState.updateResistance()
+        index = min(np.searchsorted(TimeVector, t + 1e-9*dt0, side = 'right') - 1, TimeVector.size - 1)
+        elecVoltage = signals[:, index]
+        engine.setConductance(1/junctionState.resistance)
+        if engine.changed.size > 0 or lastElecVoltage is None or np.any(elecVoltage != lastElecVoltage):
+            wireVoltage, electrodeCurrent = engine.solve(elecVoltage)
+            lastElecVoltage = elecVoltage
+            numOfSolves += 1
+        junctionState.voltage = wireVoltage[edgeList[:,0]] - wireVoltage[edgeList[:,1]]
+
+        # never step over a change of the stimulus or past the end
+        upcoming = breakpoints[breakpoints > t + 1e-9*dt0]
+        limit = min(upcoming[0] if upcoming.size > 0 else endTime, endTime) - t
+        k = max(min(k, int(np.floor(limit/dtMin + 1e-6))), 1)
+
+        before = junctionState.filamentState.copy()
+        wasOn = abs(before) >= junctionState.critialFlux
+        while True:
+            dt = k*dtMin
+            junctionState.filamentState = before.copy()
+            junctionState.updateJunctionState(dt)
+            after = junctionState.filamentState
+            overshoot = (np.sign(after)*np.sign(before) < 0) & \
+                        (abs(junctionState.voltage) < junctionState.resetVoltage)
+            after[overshoot] = 0
+            change = abs(after - before)
+            maxChange = change.max() if change.size > 0 else 0
+            crossing = (abs(after) >= junctionState.critialFlux) != wasOn
+            if k == 1 or (maxChange <= fluxTol and not crossing.any()):
+                break
+            # land on the step of the first crossing, or within fluxTol;
+            # rounding errs short, the crossing then comes a step later
+            newK = int(np.floor(k*min(1, fluxTol/maxChange)))
+            if crossing.any():
+                distance = abs(junctionState.critialFlux - abs(before[crossing]))
+                fraction = distance/np.maximum(change[crossing], 1e-300)
+                newK = min(newK, int(np.ceil(fraction.min()*k - 1e-6)))
+            newK = max(newK, 1)
+            if newK >= k:
+                break
+            k = newK
+
+        record['time'].append(t)
+        record['stepSize'].append(dt)
+        record['wireVoltage'].append(wireVoltage)
+        record['electrodeCurrent'].append(electrodeCurrent)
+        record['filamentState'].append(after.copy())
+        record['junctionVoltage'].append(junctionState.voltage)
+        record['junctionResistance'].append(junctionState.resistance.copy())
+        record['junctionSwitch'].append(junctionState.OnOrOff.copy())
+
+        elapsed += k
+        t = startTime + elapsed*dtMin
+        progress.update(min(int(round(t/dt0)), TimeVector.size) - progress.n)
+        if maxChange < fluxTol/2:
+            k = min(2*k, kMax)
+    progress.close()
+
+    for field in record:
+        record[field] = np.array(record[field])
+
+    import dataStruct
+    from utils import packNetwork
+    Network = dataStruct.network__()
+    Network.numOfSolves = numOfSolves
+    if resample:
+        resampleRecord(record, TimeVector[startStep:], dt0, initialState)
+        Network.networkCurrent = np.zeros(TimeVector.size - startStep)
+    else:
+        Network.networkCurrent = np.zeros(record['time'].size)
+    for field in ['wireVoltage', 'electrodeCurrent', 'filamentState', 'junctionVoltage',
+                'junctionResistance', 'junctionSwitch']:
+        setattr(Network, field, record[field])
+
+    Network = packNetwork(Network, simulationOptions, connectivity,
+                        junctionState, simulationOptions.stimulus)
+    if not resample:
+        Network.TimeVector = record['time']
+        Network.stepSize = record['stepSize']
+    else:
+        Network.TimeVector = TimeVector[startStep:]
+    return Network
+
+def resampleRecord(record, TimeVector, dt0, initialState):
+    """
+    Bring the accepted steps onto the fixed grid in place. Solutions are
+    held between steps; filament states are interpolated, row k being the
+    state at TimeVector[k] + dt0 as in simulateNetworkPlus.
+    """
+    held = np.searchsorted(record['time'], TimeVector + 1e-9*dt0, side = 'right') - 1
+    for field in ['wireVoltage', 'electrodeCurrent', 'junctionVoltage',
+                'junctionResistance', 'junctionSwitch']:
+        record[field] = record[field][held]
+
+    end = record['time'] + record['stepSize']
+    target = TimeVector + dt0
+    right = np.clip(np.searchsorted(end, target - 1e-9*dt0), 0, end.size - 1)
+    left = right - 1
+    start = np.where(left >= 0, end[np.maximum(left, 0)], record['time'][0])
+    weight = np.clip((target - start)/(end[right] - start), 0, 1)[:, None]
+    previous = record['filamentState'][np.maximum(left, 0)]
+    previous[left < 0] = initialState
+    record['filamentState'] = previous + weight*(record['filamentState'][right] - previous)
+
+def filamentRates(junctionState, dt):
+    """
+    Per step filament change of junctionState__.updateJunctionState under
+    the current junction voltages: growth above setVoltage, decay towards
+    zero (decay > 0) below resetVoltage.
+    """
+    absVoltage = abs(junctionState.voltage)
+    growth = (absVoltage > junctionState.setVoltage) * \
+            (absVoltage - junctionState.setVoltage) * np.sign(junctionState.voltage) * dt
+    decay = (absVoltage < junctionState.resetVoltage) * \
+            (junctionState.resetVoltage - absVoltage) * dt * 10
+    return growth, decay
+
+def stepsToSwitch(filamentState, growth, decay, criticalFlux):
+    """
+    Number of fixed steps after which each junction's OnOrOff flips, inf
+    if it never does under the current voltages.
+    """
+    steps = np.full(filamentState.size, np.inf)
+    isOn = abs(filamentState) >= criticalFlux
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        # off, growing towards +-criticalFlux
+        target = criticalFlux*np.sign(growth)
+        rising = ~isOn & (growth != 0)
+        steps[rising] = np.ceil((target[rising] - filamentState[rising])/growth[rising])
+        # on, growth pulling it back through zero
+        falling = isOn & (growth != 0) & (np.sign(growth) != np.sign(filamentState))
+        steps[falling] = np.floor((abs(filamentState[falling]) - criticalFlux)/abs(growth[falling])) + 1
+        # on, decaying
+        decaying = isOn & (decay > 0)
+        steps[decaying] = np.floor((abs(filamentState[decaying]) - criticalFlux)/decay[decaying]) + 1
+    return np.maximum(steps, 1)
+
+def advanceFilament(filamentState, growth, decay, steps, maxFlux):
+    """
+    Filament states after the given number of fixed steps, in closed form:
+    shape (E,) for a single number of steps, (len(steps), E) for an array.
+    """
+    k = np.asarray(steps)[..., None] if np.ndim(steps) > 0 else steps
+    grown = np.clip(filamentState + k*growth, -maxFlux, maxFlux)
+    decayed = np.sign(filamentState)*np.maximum(abs(filamentState) - k*decay, 0)
+    return np.where(decay > 0, decayed, grown)
+
+def fillFilament(out, filamentState, growth, decay, maxFlux, chunkSize = 2**20):
+    """
+    out[k-1] = the filament states after k steps, for every row of out,
+    computed in chunks of about chunkSize values so a long jump never
+    holds more than one chunk of temporaries.
+    """
+    rows = max(1, chunkSize//max(filamentState.size, 1))
+    for start in range(0, out.shape[0], rows):
+        stop = min(start + rows, out.shape[0])
+        out[start:stop] = advanceFilament(filamentState, growth, decay,
+                                          np.arange(start+1, stop+1), maxFlux)
+
+def simulateNetworkEvents(simulationOptions, connectivity, junctionState,
+                            solver = 'dense', resample = True, startStep = 0):
+    """
+    Event-driven simulation of a junctionState__ network under piecewise
+    constant stimuli ('DC', 'pulse', 'Drain'). Between events the junction
+    voltages are fixed and the filament states move linearly, so the run
+    jumps from one event (a junction switching or the stimulus changing)
+    to the next, solving the circuit once per event. Event times are
+    rounded up to the simulationOptions.dt grid, which makes them the steps
+    on which simulateNetworkPlus switches the same junctions. Only the
+    binary atomic switch model has such events.
+
+    resample = True fills every step of simulationOptions.TimeVector as
+    simulateNetworkPlus does; otherwise one row per event is returned with
+    Network.TimeVector the event times and Network.stepSize their lengths.
+    startStep starts the run at TimeVector[startStep], as in
+    simulateNetworkPlus.
+    """
+    dt = simulationOptions.dt
+    niterations = simulationOptions.NumOfIterations
+    electrodes = simulationOptions.electrodes
+    numOfElectrodes = len(electrodes)
+    E = connectivity.numOfJunctions
+    V = connectivity.numOfWires
+    edgeList = connectivity.edge_list
+    signals = np.array([simulationOptions.stimulus[i].signal for i in range(numOfElectrodes)])
+    signals = signals[:, 0:niterations]
+    breakSteps = np.flatnonzero(np.any(np.diff(signals, axis=1) != 0, axis=0)) + 1
+
+    from junctionModels import atomicSwitch__
+    if type(getattr(junctionState, 'model', atomicSwitch__())) is not atomicSwitch__:
+        raise ValueError('simulateNetworkEvents needs the binary atomic switch model, '
+                            'use simulateNetworkPlus or simulateNetworkAdaptive for %s.'
+                            % junctionState.type)
+
+    from mna import mnaSolver__
+    engine = mnaSolver__(connectivity, electrodes, solver = solver)
+
+    if not resample:
+        record = dict(time = [], stepSize = [], wireVoltage = [], electrodeCurrent = [],
+                    filamentState = [], junctionVoltage = [], junctionResistance = [],
+                    junctionSwitch = [])
+    import dataStruct
+    Network = dataStruct.network__()
+    if resample:
+        numOfRows = niterations - startStep
+        Network.filamentState = np.zeros((numOfRows, E))
+        Network.junctionVoltage = np.zeros((numOfRows, E))
+        Network.junctionResistance = np.zeros((numOfRows, E))
+        Network.junctionSwitch = np.zeros((numOfRows, E), dtype = bool)
+        Network.wireVoltage = np.zeros((numOfRows, V))
+        Network.electrodeCurrent = np.zeros((numOfRows, numOfElectrodes))
+
+    this_time = startStep
+    numOfEvents = 0
+    progress = tqdm(total = niterations, initial = startStep, desc = 'Running Event Simulation ')
+    while this_time < niterations:
+        junctionState.updateResistance()
+        engine.setConductance(1/junctionState.resistance)
+        wireVoltage, electrodeCurrent = engine.solve(signals[:, this_time])
+        junctionState.voltage = wireVoltage[edgeList[:,0]] - wireVoltage[edgeList[:,1]]
+        numOfEvents += 1
+
+        growth, decay = filamentRates(junctionState, dt)
+        n = stepsToSwitch(junctionState.filamentState, growth, decay, junctionState.critialFlux)
+        upcoming = breakSteps[breakSteps > this_time]
+        nextStep = upcoming[0] if upcoming.size > 0 else niterations
+        n = int(min(n.min(), nextStep - this_time))
+
+        # only the state at the next event is needed to go on, the steps
+        # in between are filled in (chunk by chunk) when resampling
+        final = advanceFilament(junctionState.filamentState, growth, decay, n,
+                                junctionState.maxFlux)
+        if resample:
+            span = slice(this_time - startStep, this_time - startStep + n)
+            fillFilament(Network.filamentState[span], junctionState.filamentState,
+                        growth, decay, junctionState.maxFlux)
+            Network.junctionVoltage[span] = junctionState.voltage
+            Network.junctionResistance[span] = junctionState.resistance
+            Network.junctionSwitch[span] = junctionState.OnOrOff
+            Network.wireVoltage[span] = wireVoltage
+            Network.electrodeCurrent[span] = electrodeCurrent
+        else:
+            record['time'].append(simulationOptions.TimeVector[this_time])
+            record['stepSize'].append(n*dt)
+            record['wireVoltage'].append(wireVoltage)
+            record['electrodeCurrent'].append(electrodeCurrent)
+            record['filamentState'].append(final)
+            record['junctionVoltage'].append(junctionState.voltage)
+            record['junctionResistance'].append(junctionState.resistance.copy())
+            record['junctionSwitch'].append(junctionState.OnOrOff.copy())
+
+        junctionState.filamentState = final
+        this_time += n
+        progress.update(n)
+    progress.close()
+
+    Network.numOfSolves = numOfEvents
+    if not resample:
+        for field in record:
+            record[field] = np.array(record[field])
+        for field in ['wireVoltage', 'electrodeCurrent', 'filamentState', 'junctionVoltage',
+                    'junctionResistance', 'junctionSwitch']:
+            setattr(Network, field, record[field])
+        Network.networkCurrent = np.zeros(record['time'].size)
+    else:
+        Network.networkCurrent = np.zeros(niterations - startStep)
+
+    from utils import packNetwork
+    Network = packNetwork(Network, simulationOptions, connectivity,
+                        junctionState, simulationOptions.stimulus)
+    if not resample:
+        Network.TimeVector = record['time']
+        Network.stepSize = record['stepSize']
+    else:
+        Network.TimeVector = simulationOptions.TimeVector[startStep:]
+    return Network
@@ -0,0 +1,160 @@
+"""
+In-place update kernels of junctionState__.
+
+updateFilament and updateResistance overwrite filamentState, resistance
+and OnOrOff of a junctionState__ instead of binding new arrays, using work
+buffers that are allocated once per state. Every product is evaluated in
+the same order as in the original expressions, so the states are
+identical to those of the original update (up to the sign of zero).
+
+By default (backend 'numpy') the updates run as a short sequence of
+ufuncs with out=. backend 'numba' is opt-in and needs numba installed: it
+runs each update as a single compiled loop over the junctions.
+benchJunctionState.py checks the states of both backends against the
+original code, step by step, and times them.
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+defaultBackend = 'numpy'
+
+class workBuffers__:
+    def __init__(self, shape):
+        self.shape = shape
+        self.absolute = np.empty(shape)
+        self.delta = np.empty(shape)
+        self.work = np.empty(shape)
+
+def buffersFor(junctionState):
+    shape = np.shape(junctionState.filamentState)
+    buffers = getattr(junctionState, 'workBuffers', None)
+    if buffers is None or buffers.shape != shape:
+        buffers = workBuffers__(shape)
+        junctionState.workBuffers = buffers
+    return buffers
+
+def updateFilamentNumpy(filament, voltage, setVoltage, resetVoltage, maxFlux, dt, buffers):
+    absolute, delta, work = buffers.absolute, buffers.delta, buffers.work
+
+    # growth above setVoltage, in the direction of the voltage:
+    # max(v-set, 0) + min(v+set, 0) is (|v|-set)*sign(v) above the threshold
+    # and 0 below it, exactly, without the mask and np.sign passes
+    np.subtract(voltage, setVoltage, out=delta)
+    np.maximum(delta, 0, out=delta)
+    np.add(voltage, setVoltage, out=work)
+    np.minimum(work, 0, out=work)
+    np.add(delta, work, out=delta)
+    np.multiply(delta, dt, out=delta)
+    np.add(filament, delta, out=filament)
+
+    # decay towards zero below resetVoltage
+    np.abs(voltage, out=absolute)
+    np.subtract(resetVoltage, absolute, out=delta)
+    np.maximum(delta, 0, out=delta)
+    np.sign(filament, out=work)
+    np.multiply(delta, work, out=delta)
+    np.multiply(delta, dt, out=delta)
+    np.multiply(delta, 10, out=delta)
+    np.subtract(filament, delta, out=filament)
+
+    np.clip(filament, -maxFlux, maxFlux, out=filament)
+
+def updateResistanceNumpy(filament, onOrOff, resistance, onResistance, offResistance,
+                            criticalFlux, buffers):
+    np.abs(filament, out=buffers.absolute)
+    np.greater_equal(buffers.absolute, criticalFlux, out=onOrOff)
+    np.subtract(onResistance, offResistance, out=resistance)
+    np.multiply(resistance, onOrOff, out=resistance)
+    np.add(offResistance, resistance, out=resistance)
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def updateFilamentNumba(filament, voltage, setVoltage, resetVoltage, maxFlux, dt):
+        for i in range(filament.size):
+            absolute = abs(voltage[i])
+            if absolute > setVoltage:
+                filament[i] += (absolute - setVoltage)*np.sign(voltage[i])*dt
+            if absolute < resetVoltage:
+                filament[i] -= (resetVoltage - absolute)*np.sign(filament[i])*dt*10
+            if filament[i] > maxFlux:
+                filament[i] = maxFlux
+            elif filament[i] < -maxFlux:
+                filament[i] = -maxFlux
+
+    @numba.njit(cache=True)
+    def updateResistanceNumba(filament, onOrOff, resistance, onResistance, offResistance,
+                                criticalFlux):
+        for i in range(filament.size):
+            onOrOff[i] = abs(filament[i]) >= criticalFlux
+            resistance[i] = offResistance[i] + (onResistance[i] - offResistance[i])*onOrOff[i]
+
+def flatViews(*arrays):
+    """
+    1-d views of the arrays for the compiled loops, or None if one of them
+    cannot be viewed that way.
+    """
+    views = []
+    for array in arrays:
+        if not isinstance(array, np.ndarray) or not array.flags.c_contiguous:
+            return None
+        views.append(array.reshape(-1))
+    return views
+
+def ensureArrays(junctionState):
+    """
+    The kernels write into filamentState, resistance and OnOrOff, which
+    therefore have to be float/bool arrays of their own.
+    """
+    shape = np.shape(junctionState.voltage)
+    if not (isinstance(junctionState.filamentState, np.ndarray)
+            and junctionState.filamentState.dtype == float
+            and junctionState.filamentState.flags.writeable):
+        junctionState.filamentState = np.array(junctionState.filamentState, dtype=float)
+    if not (isinstance(junctionState.resistance, np.ndarray)
+            and junctionState.resistance.shape == shape
+            and junctionState.resistance.flags.writeable):
+        junctionState.resistance = np.zeros(shape)
+    if not (isinstance(junctionState.OnOrOff, np.ndarray)
+            and junctionState.OnOrOff.dtype == bool
+            and junctionState.OnOrOff.shape == shape
+            and junctionState.OnOrOff.flags.writeable):
+        junctionState.OnOrOff = np.zeros(shape, dtype=bool)
+
+def checkBackend(backend):
+    if backend not in ['numpy', 'numba']:
+        raise ValueError('Unknown backend %s, use numpy or numba.' % backend)
+    if backend == 'numba' and numba is None:
+        raise ImportError('backend numba needs numba installed.')
+
+def updateFilament(junctionState, dt, backend=None, voltage=None):
+    backend = backend or junctionState.backend
+    ensureArrays(junctionState)
+    s = junctionState
+    if voltage is None:
+        voltage = s.voltage
+    if backend == 'numba':
+        views = flatViews(s.filamentState, np.asarray(voltage, dtype=float))
+        if views is not None:
+            updateFilamentNumba(views[0], views[1], s.setVoltage, s.resetVoltage, s.maxFlux, dt)
+            return
+    updateFilamentNumpy(s.filamentState, voltage, s.setVoltage, s.resetVoltage, s.maxFlux,
+                        dt, buffersFor(s))
+
+def updateResistance(junctionState, backend=None):
+    backend = backend or junctionState.backend
+    ensureArrays(junctionState)
+    s = junctionState
+    if backend == 'numba':
+        views = flatViews(s.filamentState, s.OnOrOff, s.resistance,
+                            np.broadcast_to(s.onResistance, s.resistance.shape),
+                            np.broadcast_to(s.offResistance, s.resistance.shape))
+        if views is not None:
+            updateResistanceNumba(*views, s.critialFlux)
+            return
+    updateResistanceNumpy(s.filamentState, s.OnOrOff, s.resistance, s.onResistance,
+                            s.offResistance, s.critialFlux, buffersFor(s))
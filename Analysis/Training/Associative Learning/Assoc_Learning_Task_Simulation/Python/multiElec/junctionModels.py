@@ -0,0 +1,128 @@
+"""
+Junction models of junctionState__.
+
+A model turns the filament states of a junctionState__ into resistances
+and moves the filaments under the junction voltages, vectorised over all
+junctions (and over the batch of a batched state):
+    updateResistance(junctionState)  resistance and OnOrOff, in place
+    conductance(junctionState)       the same, returns 1/resistance
+    advance(junctionState, voltage, dt)  filamentState, in place
+jacobianHint tells the solvers how the conductances change over a step:
+    'binary'  two values per junction, only switching junctions change, so
+              mnaSolver__ absorbs events with low-rank (Woodbury) updates
+    'smooth'  every junction changes a little on every step, rank updates
+              do not pay off and the matrix is refactorised instead
+OnOrOff (|filamentState| >= criticalFlux) is kept for every model, so the
+recorders and junctionSwitch traces work unchanged.
+
+Models are registered by name, junctionState__(model = 'tunnelling') or
+junctionState__(model = tunnelling__(gapWidth = 2)). registerJunctionModel
+adds new ones.
+"""
+
+import numpy as np
+
+class atomicSwitch__:
+    """
+    The original binary model: the filament grows with the voltage above
+    setVoltage, decays below resetVoltage, and the junction is onResistance
+    when |filamentState| >= criticalFlux and offResistance otherwise.
+    """
+    type = 'Atomic_Switch'
+    jacobianHint = 'binary'
+
+    def updateResistance(self, junctionState):
+        from junctionKernels import updateResistance
+        updateResistance(junctionState)
+
+    def conductance(self, junctionState):
+        self.updateResistance(junctionState)
+        return 1/junctionState.resistance
+
+    def advance(self, junctionState, voltage, dt):
+        from junctionKernels import updateFilament
+        updateFilament(junctionState, dt, voltage = voltage)
+
+class tunnelling__(atomicSwitch__):
+    """
+    Filament dynamics of the atomic switch, with the conductance of the
+    gap left between the filament and the other wire instead of a binary
+    switch. The gap closes linearly from gapWidth (nm) at zero filament
+    to 0 at criticalFlux, and the tunnelling conductance decays
+    exponentially with it:
+        G = 1/offResistance + (1/onResistance - 1/offResistance)*exp(-gap/decayLength)
+    """
+    type = 'Tunnelling'
+    jacobianHint = 'smooth'
+
+    def __init__(self, gapWidth = 1.0, decayLength = 0.1):
+        self.gapWidth = gapWidth
+        self.decayLength = decayLength
+
+    def updateResistance(self, junctionState):
+        s = junctionState
+        absolute = abs(s.filamentState)
+        s.OnOrOff[...] = absolute >= s.critialFlux
+        gap = np.maximum(s.critialFlux - absolute, 0)/s.critialFlux*self.gapWidth
+        onConductance = 1/s.onResistance
+        offConductance = 1/s.offResistance
+        G = offConductance + (onConductance - offConductance)*np.exp(-gap/self.decayLength)
+        np.divide(1, G, out = s.resistance)
+
+class linearMemristor__:
+    """
+    Flux-controlled linear memristor: the state integrates the junction
+    voltage, filamentState += voltage*dt, within +-maxFlux, and the
+    resistance moves linearly from offResistance to onResistance with
+    w = |filamentState|/maxFlux.
+    """
+    type = 'Linear_Memristor'
+    jacobianHint = 'smooth'
+
+    def updateResistance(self, junctionState):
+        s = junctionState
+        absolute = abs(s.filamentState)
+        s.OnOrOff[...] = absolute >= s.critialFlux
+        w = np.minimum(absolute/s.maxFlux, 1)
+        np.add(s.offResistance, (s.onResistance - s.offResistance)*w, out = s.resistance)
+
+    def conductance(self, junctionState):
+        self.updateResistance(junctionState)
+        return 1/junctionState.resistance
+
+    def advance(self, junctionState, voltage, dt):
+        s = junctionState
+        np.add(s.filamentState, np.multiply(voltage, dt), out = s.filamentState)
+        np.clip(s.filamentState, -s.maxFlux, s.maxFlux, out = s.filamentState)
+
+junctionModels = {'binary': atomicSwitch__,
+                  'atomicSwitch': atomicSwitch__,
+                  'tunnelling': tunnelling__,
+                  'tunneling': tunnelling__,
+                  'linear': linearMemristor__}
+
+def registerJunctionModel(name, model):
+    """
+    model is a class (instantiated without arguments) with the methods
+    and attributes of atomicSwitch__.
+    """
+    junctionModels[name] = model
+
+def getJunctionModel(model):
+    if model is None:
+        model = 'binary'
+    if isinstance(model, str):
+        if model not in junctionModels:
+            raise ValueError('Unknown junction model %s, choose from %s.'
+                                % (model, sorted(junctionModels)))
+        return junctionModels[model]()
+    return model
+
+def solverOptions(junctionState):
+    """
+    Keyword arguments of mnaSolver__ suited to the model of junctionState.
+    """
+    model = getattr(junctionState, 'model', None)
+    if model is not None and model.jacobianHint != 'binary':
+        return dict(maxRank = 0)
+    return {}
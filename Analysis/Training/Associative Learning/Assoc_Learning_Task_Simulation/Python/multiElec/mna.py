@@ -0,0 +1,327 @@
+"""
+Modified nodal analysis for simulateNetworkPlus.
+
+The electrode voltages are known, so instead of the augmented
+(V+electrodes) system the sparse solvers work on the Laplacian restricted
+to the free (non-electrode) wires:
+    L_ff v_f = -L_fe v_e
+which is symmetric positive definite as long as every component of the
+network touches an electrode. Electrode currents follow from KCL,
+    i_e = -(L v)_e
+which matches sol[V:] of the dense augmented solve.
+
+mnaSolver__ is persistent across time steps. setConductance only touches
+the matrix entries of junctions whose conductance changed since the last
+call, and the factorisation is reused untouched when nothing switched.
+
+solver='dense' solves the augmented system with np.linalg.solve, as the
+original simulateNetworkPlus did, so its results are bit-identical to it.
+It keeps no factorisation; instead the solution is reused while neither
+the matrix nor the electrode voltages change, which gives the same bits.
+
+With solver='direct' a switching event does not refactorise either. The
+k junctions whose conductance differs from the factorised one form a
+rank-k correction
+    L = L0 + U diag(dg) U^T,    U = A_f[switched]^T
+which is applied with the Woodbury identity
+    x = y - Z (diag(1/dg) + U^T Z)^-1 U^T y,    y = L0^-1 b,  Z = L0^-1 U
+Columns of Z are kept while their junction stays switched, so each new
+event costs one solve per newly switched junction. The factorisation is
+renewed once more than maxRank junctions differ or the Woodbury residual
+exceeds driftTol.
+
+portModel reduces the network onto its electrodes (Kron reduction): the
+Schur complement of the free wires
+    Y = L_ee - L_ef L_ff^-1 L_fe,    i_e = -Y v_e
+and the transfer matrix T = [I; -L_ff^-1 L_fe] (all V wires, by electrode)
+with v = T v_e. Both take one solve per electrode and are kept until the
+conductances change, after which solvePorts costs O(V*electrodes) per step
+instead of a solve.
+"""
+
+import numpy as np
+from scipy.sparse import csc_matrix, csr_matrix
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+from scipy.sparse.linalg import splu, cg, LinearOperator
+
+def incidenceMatrix(edgeList, numOfWires):
+    E = edgeList.shape[0]
+    rows = np.repeat(np.arange(E), 2)
+    cols = edgeList[:, 0:2].ravel()
+    vals = np.tile([1.0, -1.0], E)
+    return csr_matrix((vals, (rows, cols)), shape=(E, numOfWires))
+
+def buildLaplacian(edgeList, conductance, numOfWires):
+    A = incidenceMatrix(edgeList, numOfWires)
+    return (A.T @ A.multiply(conductance.reshape(-1, 1))).tocsc()
+
+class mnaSolver__:
+    def __init__(self, connectivity, electrodes, solver='direct', tol=1e-12,
+                refactorFraction=0.1, maxRank=32, driftTol=1e-8):
+        if solver not in ['dense', 'direct', 'cg']:
+            raise ValueError('Unknown solver %s, use dense, direct or cg.' % solver)
+        self.solver = solver
+        self.tol = tol
+        self.refactorFraction = refactorFraction
+        self.maxRank = maxRank
+        self.driftTol = driftTol
+
+        V = connectivity.numOfWires
+        E = connectivity.numOfJunctions
+        edgeList = np.asarray(connectivity.edge_list).astype(int)
+        self.V = V
+        self.E = E
+        self.edgeList = edgeList
+        self.electrodes = np.asarray(electrodes, dtype=int)
+        self.A = incidenceMatrix(edgeList, V)
+
+        self.conductance = None
+        self.changed = np.arange(E)
+        self.version = 0
+        self.ports = None
+        self.numOfFactorisations = 0
+        self.numOfLowRankUpdates = 0
+
+        if solver == 'dense':
+            self.initDense()
+        else:
+            self.initSparse()
+
+    def initDense(self):
+        V = self.V
+        numOfElectrodes = self.electrodes.size
+        self.W = np.zeros((V, V))
+        self.lhs = np.zeros((V+numOfElectrodes, V+numOfElectrodes))
+        for i in range(numOfElectrodes):
+            self.lhs[V+i, self.electrodes[i]] = 1
+            self.lhs[self.electrodes[i], V+i] = 1
+        self.rhs = np.zeros(V+numOfElectrodes)
+        self.sol = None
+
+    def initSparse(self):
+        V = self.V
+        isFree = np.ones(V, dtype=bool)
+        isFree[self.electrodes] = False
+        free = np.where(isFree)[0]
+
+        # Fill-reducing ordering of the free block is computed once and
+        # reused for every factorisation.
+        pattern = buildLaplacian(self.edgeList, np.ones(self.E), V)[free][:, free]
+        perm = reverse_cuthill_mckee(pattern.tocsr(), symmetric_mode=True)
+        self.free = free[perm]
+        self.nFree = self.free.size
+
+        position = np.full(V, -1)
+        position[self.free] = np.arange(self.nFree)
+        self.assemblePattern(position)
+
+        self.Afe = self.A[:, self.electrodes]
+        self.Aff = self.A[:, self.free]
+        self.touchesFree = np.diff(self.Aff.indptr) > 0
+        self.lu = None
+        self.resetLowRank()
+        self.lastSolution = np.zeros(self.nFree)
+
+    def assemblePattern(self, position):
+        """
+        Store the CSC index arrays of L_ff and a sparse map from junction
+        conductances to the data slots, so each update is a single
+        sparse mat-vec and the sparsity pattern is never rebuilt.
+        """
+        a = position[self.edgeList[:, 0]]
+        b = position[self.edgeList[:, 1]]
+        junction = np.arange(self.E)
+
+        rows = np.concatenate([a, b, a, b])
+        cols = np.concatenate([a, b, b, a])
+        sign = np.concatenate([np.ones(2*self.E), -np.ones(2*self.E)])
+        owner = np.concatenate([junction]*4)
+        keep = (rows >= 0) & (cols >= 0)
+        rows, cols, sign, owner = rows[keep], cols[keep], sign[keep], owner[keep]
+
+        n = self.nFree
+        pattern = csc_matrix((np.ones(rows.size), (rows, cols)), shape=(n, n))
+        pattern.sum_duplicates()
+        pattern.sort_indices()
+        self.indptr = pattern.indptr
+        self.indices = pattern.indices
+
+        slotCols = np.repeat(np.arange(n), np.diff(self.indptr))
+        slotKeys = slotCols.astype(np.int64)*n + self.indices
+        slot = np.searchsorted(slotKeys, cols.astype(np.int64)*n + rows)
+        # CSC so that the columns of changed junctions slice cheaply
+        self.scatter = csc_matrix((sign, (slot, owner)), shape=(slotKeys.size, self.E))
+        self.Lff = csc_matrix((np.zeros(slotKeys.size), self.indices, self.indptr), shape=(n, n))
+
+    def setConductance(self, conductance):
+        conductance = np.array(conductance, dtype=float)
+        if self.conductance is None:
+            self.changed = np.arange(self.E)
+        else:
+            self.changed = np.flatnonzero(conductance != self.conductance)
+            if self.changed.size == 0:
+                return
+        self.version += 1
+
+        if self.solver == 'dense':
+            self.updateDense(conductance)
+        else:
+            self.updateSparse(conductance)
+        self.conductance = conductance
+        if self.solver == 'direct' and self.lu is not None and self.maxRank > 0:
+            self.updateLowRank()
+        else:
+            self.factorise()
+
+    def updateDense(self, conductance):
+        edges = self.edgeList[self.changed]
+        g = conductance[self.changed]
+        self.W[edges[:,0], edges[:,1]] = g
+        self.W[edges[:,1], edges[:,0]] = g
+        self.lhs[edges[:,0], edges[:,1]] = -g
+        self.lhs[edges[:,1], edges[:,0]] = -g
+
+        # cumsum adds the rows in order, like np.sum(Gmat, axis=0) did on
+        # the full matrix, so the diagonal is bit-identical to a rebuild
+        wires = np.unique(edges[:,0:2])
+        self.lhs[wires, wires] = np.cumsum(self.W[:, wires], axis=0)[-1]
+
+    def updateSparse(self, conductance):
+        if self.conductance is None or self.changed.size > self.refactorFraction*self.E:
+            self.Lff.data = self.scatter @ conductance
+        else:
+            delta = conductance[self.changed] - self.conductance[self.changed]
+            self.Lff.data += self.scatter[:, self.changed] @ delta
+
+    def resetLowRank(self):
+        self.lowRankJunctions = np.array([], dtype=int)
+        self.Z = np.zeros((self.nFree, 0))
+
+    def updateLowRank(self):
+        switched = np.flatnonzero(self.conductance != self.factorConductance)
+        switched = switched[self.touchesFree[switched]]
+        if switched.size > self.maxRank:
+            self.factorise()
+            return
+
+        # reuse the columns of Z for junctions that were already switched
+        known = np.isin(switched, self.lowRankJunctions)
+        Z = np.zeros((self.nFree, switched.size))
+        Z[:, known] = self.Z[:, np.searchsorted(self.lowRankJunctions, switched[known])]
+        if not known.all():
+            U = self.Aff[switched[~known]].T.toarray()
+            Z[:, ~known] = self.lu.solve(U)
+        self.lowRankJunctions = switched
+        self.Z = Z
+
+        self.Ut = self.Aff[switched]
+        dg = self.conductance[switched] - self.factorConductance[switched]
+        self.capacitance = np.diag(1/dg) + (self.Ut @ Z)
+        self.numOfLowRankUpdates += 1
+
+    def factorise(self):
+        self.numOfFactorisations += 1
+        if self.solver == 'dense':
+            self.sol = None
+        elif self.solver == 'direct':
+            # start from exact data so incremental updates cannot drift
+            self.Lff.data = self.scatter @ self.conductance
+            self.lu = splu(self.Lff, permc_spec='NATURAL',
+                           diag_pivot_thresh=0, options=dict(SymmetricMode=True))
+            self.factorConductance = self.conductance.copy()
+            self.resetLowRank()
+        else:
+            diagonal = self.Lff.diagonal()
+            self.preconditioner = LinearOperator((self.nFree, self.nFree),
+                                                 matvec=lambda x: x/diagonal)
+
+    def solve(self, elecVoltage):
+        elecVoltage = np.asarray(elecVoltage, dtype=float)
+
+        if self.solver == 'dense':
+            if self.sol is None or np.any(self.rhs[self.V:] != elecVoltage):
+                self.rhs[self.V:] = elecVoltage
+                self.sol = np.linalg.solve(self.lhs, self.rhs)
+            return self.sol[0:self.V], self.sol[self.V:]
+
+        rhs = -(self.Aff.T @ (self.conductance*(self.Afe @ elecVoltage)))
+        if self.solver == 'direct':
+            freeVoltage = self.lu.solve(rhs)
+            if self.lowRankJunctions.size > 0:
+                freeVoltage = self.woodburySolve(rhs, freeVoltage)
+        else:
+            freeVoltage, info = cg(self.Lff, rhs, x0=self.lastSolution,
+                                   rtol=self.tol, atol=0, M=self.preconditioner)
+            if info > 0:
+                print('CG did not converge in %d iterations.' % info)
+        self.lastSolution = freeVoltage
+
+        wireVoltage = np.zeros(self.V)
+        wireVoltage[self.free] = freeVoltage
+        wireVoltage[self.electrodes] = elecVoltage
+        junctionCurrent = self.conductance*(self.A @ wireVoltage)
+        electrodeCurrent = -(self.A.T @ junctionCurrent)[self.electrodes]
+        return wireVoltage, electrodeCurrent
+
+    def solveMany(self, elecVoltages):
+        """
+        Solve P electrode voltage patterns, shape (P, electrodes), at the
+        current conductances as one multi-RHS solve (with the factorisation
+        in place for 'direct'). Returns wireVoltage (P, V) and electrodeCurrent
+        (P, electrodes), row p as solve(elecVoltages[p]) gives them.
+        """
+        elecVoltages = np.atleast_2d(np.asarray(elecVoltages, dtype=float))
+        P = elecVoltages.shape[0]
+
+        if self.solver == 'dense':
+            rhs = np.zeros((self.V+self.electrodes.size, P))
+            rhs[self.V:] = elecVoltages.T
+            sol = np.linalg.solve(self.lhs, rhs)
+            return sol[0:self.V].T, sol[self.V:].T
+
+        rhs = -(self.Aff.T @ (self.conductance[:, None]*(self.Afe @ elecVoltages.T)))
+        if self.solver == 'direct':
+            freeVoltage = self.lu.solve(rhs)
+            if self.lowRankJunctions.size > 0:
+                freeVoltage = self.woodburySolve(rhs, freeVoltage)
+        else:
+            freeVoltage = np.zeros((self.nFree, P))
+            for p in range(P):
+                freeVoltage[:, p], info = cg(self.Lff, rhs[:, p], x0=self.lastSolution,
+                                             rtol=self.tol, atol=0, M=self.preconditioner)
+                if info > 0:
+                    print('CG did not converge in %d iterations.' % info)
+
+        wireVoltage = np.zeros((self.V, P))
+        wireVoltage[self.free] = freeVoltage
+        wireVoltage[self.electrodes] = elecVoltages.T
+        junctionCurrent = self.conductance[:, None]*(self.A @ wireVoltage)
+        electrodeCurrent = -(self.A.T @ junctionCurrent)[self.electrodes]
+        return wireVoltage.T, electrodeCurrent.T
+
+    def portModel(self):
+        """
+        Returns the electrode admittance Y (electrodes, electrodes) and the
+        transfer matrix T (V, electrodes) at the current conductances.
+        """
+        if self.ports is None or self.ports[0] != self.version:
+            wireVoltage, electrodeCurrent = self.solveMany(np.eye(self.electrodes.size))
+            self.ports = (self.version, -electrodeCurrent.T, wireVoltage.T)
+        return self.ports[1], self.ports[2]
+
+    def solvePorts(self, elecVoltage):
+        """
+        solve() through the port model, for steps on which no junction
+        switched.
+        """
+        Y, T = self.portModel()
+        elecVoltage = np.asarray(elecVoltage, dtype=float)
+        return T @ elecVoltage, -(Y @ elecVoltage)
+
+    def woodburySolve(self, rhs, y):
+        x = y - self.Z @ np.linalg.solve(self.capacitance, self.Ut @ y)
+        residual = np.linalg.norm(rhs - self.Lff @ x)
+        if residual > self.driftTol*np.linalg.norm(rhs):
+            self.factorise()
+            x = self.lu.solve(rhs)
+        return x
@@ -0,0 +1,41 @@
+"""
+Reader of the binary network format written by export_to_network and
+mat_to_network in Generate Networks/wires.py.
+
+A network is a directory <name>.nwn with a header.json (scalar values and
+the list of columns) and one .npy file per column. The columns are opened
+as read-only memory maps, so loading costs the header only and the arrays
+are paged in when they are used. connectivity__ loads these directories in
+place of .mat files.
+"""
+
+import os
+import json
+import numpy as np
+
+def isNetworkFile(path):
+    return os.path.isfile(os.path.join(path, 'header.json'))
+
+def loadNetwork(path, mmapMode='r'):
+    """
+    Returns {key: value} like scipy.io.loadmat(..., squeeze_me=True), with
+    the columns as memory maps (mmapMode=None reads them into memory).
+    """
+    with open(os.path.join(path, 'header.json')) as f:
+        header = json.load(f)
+    if header.get('format') != 'nwn':
+        raise ValueError('%s is not a network file.' % path)
+
+    network = dict(header['scalars'])
+    for key, column in header['columns'].items():
+        network[key] = np.load(os.path.join(path, key + '.npy'), mmap_mode=mmapMode)
+        if list(network[key].shape) != column['shape']:
+            raise ValueError('%s/%s.npy does not match the header.' % (path, key))
+    return network
+
+def adjacencyMatrix(edgeList, numOfWires):
+    adjMat = np.zeros((numOfWires, numOfWires))
+    edgeList = np.asarray(edgeList, dtype=int)
+    adjMat[edgeList[:,0], edgeList[:,1]] = 1
+    adjMat[edgeList[:,1], edgeList[:,0]] = 1
+    return adjMat
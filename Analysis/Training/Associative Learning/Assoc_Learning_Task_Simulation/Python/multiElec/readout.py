@@ -0,0 +1,56 @@
+"""
+Read-out of a network whose junction state is frozen.
+
+Testing a trained network (EquilProp testing, n-back testing) applies many
+input patterns to the same junction state. Re-running simulateNetworkPlus
+for every pattern rebuilds and refactorises the same conductance system
+each time; while the junctions do not move, the network is linear, so
+readout__ factorises it once and solves every pattern against that one
+factorisation, a whole batch of patterns as one multi-RHS solve.
+
+A pattern is one voltage per electrode (0 for the drains), in the order of
+the electrodes:
+    patterns = np.array([[1, 0, 0], [0, 1, 0], [1, 1, 0]])
+    currents = readoutNetwork(connectivity, junctionState, electrodes, patterns)
+currents[p] are the electrode currents of pattern p, the electrodeCurrent
+of a simulateNetworkPlus step with those electrode voltages.
+
+The read-out does not move the junctions, which holds for read voltages
+below setVoltage (and resetVoltage decay over the read time neglected).
+"""
+
+import numpy as np
+
+class readout__:
+    def __init__(self, connectivity, electrodes, junctionState, solver='direct'):
+        from mna import mnaSolver__
+        # the factorisation is kept for the read-out, never updated
+        self.engine = mnaSolver__(connectivity, electrodes, solver = solver, maxRank = 0)
+        self.edgeList = self.engine.edgeList
+        self.setState(junctionState)
+
+    def setState(self, junctionState):
+        """
+        Factorise the system of another (single, not batched) junction
+        state on the same connectivity and electrodes.
+        """
+        if np.ndim(junctionState.filamentState) != 1:
+            raise ValueError('readout__ takes a single junctionState__, not a batch.')
+        junctionState.updateResistance()
+        self.engine.setConductance(1/junctionState.resistance)
+
+    def solve(self, patterns):
+        """
+        Returns wireVoltage (P, V) and electrodeCurrent (P, electrodes).
+        """
+        return self.engine.solveMany(patterns)
+
+    def electrodeCurrent(self, patterns):
+        return self.solve(patterns)[1]
+
+    def junctionVoltage(self, patterns):
+        wireVoltage = self.solve(patterns)[0]
+        return wireVoltage[:, self.edgeList[:,0]] - wireVoltage[:, self.edgeList[:,1]]
+
+def readoutNetwork(connectivity, junctionState, electrodes, patterns, solver='direct'):
+    return readout__(connectivity, electrodes, junctionState, solver).electrodeCurrent(patterns)
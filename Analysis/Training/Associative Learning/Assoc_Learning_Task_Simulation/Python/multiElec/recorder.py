@@ -0,0 +1,176 @@
+"""
+Recording of the per-step traces of the simulators.
+
+A recorder__ is the recording policy of a run: which fields are kept,
+for which junctions and wires, and at which steps (every N-th step and/or
+every step on which a junction switched). simulateNetworkPlus and
+simulateNetwork_backprop (n-back) both take one.
+
+The default recorder__() keeps every field at every step in memory, as
+the simulators always did. With path set, each field is streamed to
+path/<field>.npy instead: rows are collected in a small buffer of
+chunkSize steps and copied into a memory-mapped .npy file when it is
+full, so memory use is bounded by the buffer and not by the run length.
+The files are ordinary .npy arrays (np.load(..., mmap_mode='r')) and the
+returned network__ holds read-only memory maps of them.
+"""
+
+import os
+import numpy as np
+
+from numpy.lib.format import open_memmap
+
+class recorder__:
+    def __init__(self, fields=None, every=1, path=None, chunkSize=1000,
+                junctions=None, wires=None, onSwitch=False):
+        """
+        fields: names of the traces to keep, None keeps all of them.
+        every: keep one step in every N, None keeps none on a schedule.
+        onSwitch: also keep every step on which a junction switched.
+        junctions, wires: indices to keep of the per-junction and per-wire
+            traces, None keeps all of them.
+        path: directory for the .npy files, None keeps the traces in RAM.
+        """
+        if every is None and not onSwitch:
+            raise ValueError('Nothing would be recorded, set every or onSwitch.')
+        self.fields = fields
+        self.every = every
+        self.onSwitch = onSwitch
+        self.junctions = junctions
+        self.wires = wires
+        self.path = path
+        self.chunkSize = chunkSize
+
+    def allocate(self, niterations, layout, startStep=0):
+        """
+        layout maps each field the simulator can record to
+        (width, dtype, kind), kind being 'junction', 'wire' or None.
+        The run covers steps startStep..niterations-1.
+        """
+        if self.fields is not None:
+            unknown = set(self.fields) - set(layout)
+            if unknown:
+                raise ValueError('Cannot record %s, choose from %s.' % (sorted(unknown), sorted(layout)))
+            layout = {field: layout[field] for field in self.fields}
+
+        self.select = {}
+        widths = {}
+        for field, (width, dtype, kind) in layout.items():
+            subset = dict(junction=self.junctions, wire=self.wires).get(kind)
+            self.select[field] = subset
+            widths[field] = width if subset is None else len(subset)
+        self.layout = {field: (widths[field], layout[field][1]) for field in layout}
+
+        if self.onSwitch:
+            capacity = niterations - startStep
+        else:
+            capacity = len(range(startStep + (-startStep) % self.every, niterations, self.every))
+        self.steps = []
+        self.lastSwitch = None
+        self.row = 0
+
+        if self.path is None:
+            # grown on demand when the number of rows is not known upfront
+            self.capacity = min(capacity, self.chunkSize) if self.onSwitch else capacity
+            self.store = {field: np.zeros((self.capacity, width), dtype=dtype)
+                            for field, (width, dtype) in self.layout.items()}
+            return
+
+        # the files are created sparse, so an onSwitch bound of niterations
+        # rows costs no disk space until it is written
+        os.makedirs(self.path, exist_ok=True)
+        self.store = {field: open_memmap(os.path.join(self.path, field + '.npy'), mode='w+',
+                                        dtype=dtype, shape=(capacity, width))
+                        for field, (width, dtype) in self.layout.items()}
+        self.buffer = {field: np.zeros((self.chunkSize, width), dtype=dtype)
+                        for field, (width, dtype) in self.layout.items()}
+        self.bufferStart = 0
+
+    def wants(self, this_time, junctionSwitch=None):
+        scheduled = self.every is not None and this_time % self.every == 0
+        if not self.onSwitch:
+            return scheduled
+        switched = self.lastSwitch is None or np.any(junctionSwitch != self.lastSwitch)
+        self.lastSwitch = np.array(junctionSwitch)
+        return scheduled or switched
+
+    def record(self, this_time, **values):
+        self.steps.append(this_time)
+        if self.path is None:
+            if self.row == self.capacity:
+                self.grow()
+            target, slot = self.store, self.row
+        else:
+            target, slot = self.buffer, self.row - self.bufferStart
+        for field in target:
+            if self.select[field] is None:
+                target[field][slot] = values[field]
+            else:
+                target[field][slot] = values[field][self.select[field]]
+        self.row += 1
+        if self.path is not None and self.row - self.bufferStart == self.chunkSize:
+            self.flush()
+
+    def grow(self):
+        self.capacity *= 2
+        for field in self.store:
+            bigger = np.zeros((self.capacity,) + self.store[field].shape[1:], dtype=self.store[field].dtype)
+            bigger[0:self.row] = self.store[field]
+            self.store[field] = bigger
+
+    def flush(self):
+        n = self.row - self.bufferStart
+        for field in self.buffer:
+            self.store[field][self.bufferStart:self.row] = self.buffer[field][0:n]
+            self.store[field].flush()
+        self.bufferStart = self.row
+
+    def finish(self, Network):
+        """
+        Attach the traces to Network and restrict its TimeVector to the
+        recorded steps.
+        """
+        self.steps = np.array(self.steps, dtype=int)
+        if self.path is None:
+            self.store = {field: self.store[field][0:self.row] for field in self.store}
+        else:
+            self.flush()
+            np.save(os.path.join(self.path, 'recordedSteps.npy'), self.steps)
+            self.store = None
+            for field in self.layout:
+                truncateNpy(os.path.join(self.path, field + '.npy'), self.row)
+            self.store = {field: np.load(os.path.join(self.path, field + '.npy'), mmap_mode='r')
+                            for field in self.layout}
+            self.buffer = None
+
+        for field in self.store:
+            setattr(Network, field, self.store[field])
+        Network.recordedSteps = self.steps
+        Network.recordedJunctions = self.junctions
+        Network.recordedWires = self.wires
+        Network.TimeVector = Network.TimeVector[self.steps]
+        return Network
+
+def truncateNpy(filename, rows):
+    """
+    Shrink a C-ordered .npy file to its first rows rows in place. The new
+    header is padded to the length of the old one, so the data does not
+    move.
+    """
+    with open(filename, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortranOrder, dtype = np.lib.format.read_array_header_1_0(f)
+            prefix = 10
+        else:
+            shape, fortranOrder, dtype = np.lib.format.read_array_header_2_0(f)
+            prefix = 12
+        if shape[0] == rows:
+            return
+        dataStart = f.tell()
+        header = repr({'descr': np.lib.format.dtype_to_descr(dtype),
+                        'fortran_order': fortranOrder,
+                        'shape': (rows,) + tuple(shape[1:])})
+        f.seek(prefix)
+        f.write(header.ljust(dataStart - prefix - 1).encode('latin1') + b'\n')
+        f.truncate(dataStart + rows*int(np.prod(shape[1:]))*dtype.itemsize)
@@ -0,0 +1,19 @@
+from sweep import *
+"""
+Sweep of the junction thresholds on one network, four electrodes as in
+runMulti.py. Results go to sweep_results/, run again to resume.
+"""
+if __name__ == '__main__':
+    stimulus = [dict(biasType = 'DC', onTime = 0, offTime = 1, onAmp = 1.1, offAmp = 0.005),
+                dict(biasType = 'Drain'),
+                dict(biasType = 'DC', onTime = 0, offTime = 1, onAmp = 1.4, offAmp = 0.005),
+                dict(biasType = 'Drain')]
+
+    runs = makeGrid(dict(
+        filename = ['2016-09-08-155153_asn_nw_00100_nj_00261_seed_042_avl_100.00_disp_10.00.mat'],
+        dt = [1e-3], T = [1], interfaceElectrodes = [[73, 30, 88, 83]],
+        stimulus = [stimulus],
+        setVoltage = [1e-2, 5e-2],
+        criticalFlux = [5e-2, 1e-1, 2e-1]))
+
+    manifest = runSweep(runs, outputDir = 'sweep_results')
@@ -0,0 +1,198 @@
+"""
+Parameter sweeps of simulateNetworkPlus on a process pool.
+
+A sweep is a list of run dictionaries. Each one names a connectivity file
+and, optionally, any of
+    dt, T, interfaceElectrodes                      simulation_options__
+    setVoltage, resetVoltage, criticalFlux, maxFlux  junctionState__
+    model      junction model name, see junctionModels.py
+    stimulus   list of stimulus__ keyword dicts, one per electrode
+               (TimeVector is filled in by the worker)
+    solver     passed on to simulateNetworkPlus
+    formation  a formation protocol (a run without filename, see
+               checkpoint.py): the run starts from the state the network
+               reaches under it instead of a fresh one, with the junction
+               parameters of the formation (which default to the run's,
+               conflicting values are an error)
+makeGrid expands a dictionary of lists into the full product.
+
+Each worker loads every connectivity file once (with the fork start method
+they are inherited from the parent instead) and keeps them read-only for
+all of its runs. Every run is written to outputDir/<key>.npz by the worker
+as soon as it finishes, and a line is appended to outputDir/manifest.csv.
+Running the same sweep again skips the keys that are already in the
+manifest, so an interrupted sweep resumes where it stopped.
+
+Pre-formed states are kept in a stateLibrary__ (outputDir/preformed
+unless libraryDir is given), so each formation is simulated once for all
+runs, and sweeps, that share it.
+"""
+
+import os
+import csv
+import json
+import time
+import hashlib
+import itertools
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+optionKeys = ['dt', 'T', 'interfaceElectrodes']
+junctionKeys = ['setVoltage', 'resetVoltage', 'criticalFlux', 'maxFlux', 'model']
+savedFields = ['wireVoltage', 'electrodeCurrent', 'filamentState',
+                'junctionVoltage', 'junctionResistance', 'junctionSwitch']
+
+_connectivityCache = {}
+
+def makeGrid(grid):
+    """
+    {'criticalFlux': [0.1, 0.2], 'filename': [a, b]} -> list of 4 runs.
+    """
+    keys = list(grid.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*[grid[k] for k in keys])]
+
+def runKey(run):
+    return hashlib.sha1(json.dumps(run, sort_keys=True, default=str).encode()).hexdigest()[0:16]
+
+def loadConnectivity(filenames):
+    from utils import connectivity__
+    for filename in filenames:
+        if filename not in _connectivityCache:
+            _connectivityCache[filename] = connectivity__(filename = filename)
+
+def buildRun(run, connectivity):
+    """
+    simulation_options__ (with its stimulus) and a fresh junctionState__
+    of a run dictionary.
+    """
+    from utils import simulation_options__, junctionState__, stimulus__
+
+    simulationOptions = simulation_options__(**{k: run[k] for k in optionKeys if k in run})
+
+    if 'stimulus' in run:
+        stimulus = [stimulus__(TimeVector = simulationOptions.TimeVector, **s)
+                    for s in run['stimulus']]
+    else:
+        stimulus = [stimulus__(biasType = 'DC', TimeVector = simulationOptions.TimeVector,
+                                onTime = 0, offTime = simulationOptions.T)]
+        stimulus += [stimulus__(biasType = 'Drain', TimeVector = simulationOptions.TimeVector)
+                    for i in simulationOptions.electrodes[1:]]
+    simulationOptions.stimulus = stimulus
+
+    junctionState = junctionState__(connectivity.numOfJunctions,
+                                    **{k: run[k] for k in junctionKeys if k in run})
+    return simulationOptions, junctionState
+
+def formationProtocol(run):
+    """
+    The formation of a run, with the dt, electrodes, solver and junction
+    parameters of the run unless the formation sets its own. The run continues from
+    the formed junctionState__, so junction parameters that the run and
+    its formation both set have to agree.
+    """
+    formation = run['formation']
+    conflicts = [k for k in junctionKeys if k in run and k in formation and run[k] != formation[k]]
+    if conflicts:
+        raise ValueError('The run and its formation set different %s, the run would '
+                            'continue with those of the formation.' % ', '.join(conflicts))
+    protocol = {k: run[k] for k in ['dt', 'interfaceElectrodes', 'solver'] + junctionKeys if k in run}
+    protocol.update(formation)
+    return protocol
+
+def runOne(run, outputDir, libraryDir = None):
+    from utils import simulateNetworkPlus
+
+    start = time.time()
+    connectivity = _connectivityCache[run['filename']]
+    simulationOptions, junctionState = buildRun(run, connectivity)
+    if 'formation' in run:
+        from checkpoint import stateLibrary__
+        library = stateLibrary__(libraryDir or os.path.join(outputDir, 'preformed'))
+        junctionState = library.get(connectivity, formationProtocol(run))
+
+    Network = simulateNetworkPlus(simulationOptions, connectivity, junctionState,
+                                    solver = run.get('solver', 'dense'))
+
+    key = runKey(run)
+    data = {field: getattr(Network, field) for field in savedFields}
+    data['TimeVector'] = simulationOptions.TimeVector
+    data['sources'] = np.array(Network.sources)
+    data['drains'] = np.array(Network.drains)
+    # write under a temporary name so a killed worker never leaves a
+    # truncated result behind
+    tmpPath = os.path.join(outputDir, key + '.tmp.npz')
+    np.savez(tmpPath, **data)
+    os.replace(tmpPath, os.path.join(outputDir, key + '.npz'))
+    return key, time.time() - start
+
+def formRuns(runs, libraryDir):
+    """
+    Form every distinct formation of runs that is not in the library yet,
+    one after the other, so the workers only ever load pre-formed states.
+    """
+    from checkpoint import stateLibrary__
+    library = stateLibrary__(libraryDir)
+    formations = {}
+    for run in runs:
+        if 'formation' in run:
+            protocol = formationProtocol(run)
+            text = json.dumps(protocol, sort_keys = True, default = str)
+            formations[(run['filename'], text)] = protocol
+    todo = [(filename, protocol) for (filename, text), protocol in formations.items()
+            if (_connectivityCache[filename], protocol) not in library]
+    for count, (filename, protocol) in enumerate(todo, 1):
+        print('Forming %d/%d on %s.' % (count, len(todo), filename))
+        library.form(_connectivityCache[filename], protocol)
+
+def readManifest(outputDir):
+    path = os.path.join(outputDir, 'manifest.csv')
+    if not os.path.isfile(path):
+        return {}
+    with open(path, newline='') as f:
+        return {row['key']: row for row in csv.DictReader(f)}
+
+def runSweep(runs, outputDir = 'sweep_results', maxWorkers = None, libraryDir = None):
+    """
+    Run every entry of runs (see makeGrid) that is not yet in the manifest
+    of outputDir. Returns the manifest as {key: row}.
+    """
+    os.makedirs(outputDir, exist_ok = True)
+    manifest = readManifest(outputDir)
+    todo = [run for run in runs
+            if runKey(run) not in manifest
+            or not os.path.isfile(os.path.join(outputDir, runKey(run) + '.npz'))]
+    print('%d runs, %d done, %d to go.' % (len(runs), len(runs)-len(todo), len(todo)))
+    if len(todo) == 0:
+        return manifest
+
+    filenames = sorted(set(run['filename'] for run in todo))
+    loadConnectivity(filenames)
+    formRuns(todo, libraryDir or os.path.join(outputDir, 'preformed'))
+
+    path = os.path.join(outputDir, 'manifest.csv')
+    newFile = not os.path.isfile(path)
+    with open(path, 'a', newline='') as f, \
+            ProcessPoolExecutor(max_workers = maxWorkers, initializer = loadConnectivity,
+                                initargs = (filenames,)) as pool:
+        writer = csv.DictWriter(f, fieldnames = ['key', 'elapsed', 'run'])
+        if newFile:
+            writer.writeheader()
+        futures = {pool.submit(runOne, run, outputDir, libraryDir): run for run in todo}
+        for future in as_completed(futures):
+            run = futures[future]
+            try:
+                key, elapsed = future.result()
+            except Exception as error:
+                print('Run %s failed: %s' % (runKey(run), error))
+                continue
+            row = dict(key = key, elapsed = '%.2f' % elapsed,
+                        run = json.dumps(run, sort_keys = True, default = str))
+            writer.writerow(row)
+            f.flush()
+            manifest[key] = row
+
+    return manifest
+
+def loadResult(outputDir, key):
+    return dict(np.load(os.path.join(outputDir, key + '.npz')))
@@ -18,47 +18,72 @@ class simulation_options__:
 
 class connectivity__:
     def __init__(self, filename):
+        """
+        filename is a .mat file or a .nwn network directory (see
+        networkFile.py), whose columns are memory-mapped instead of read.
+        """
+        from networkFile import isNetworkFile, loadNetwork
         fullpath = 'connectivity/connectivity_data/' + filename
-        matfile = sio.loadmat(fullpath, squeeze_me=True, struct_as_record=False)
+        if isNetworkFile(fullpath):
+            matfile = loadNetwork(fullpath)
+        else:
+            matfile = sio.loadmat(fullpath, squeeze_me=True, struct_as_record=False)
         for key in matfile.keys():
             if key[0:2] != '__':
                 setattr(self, key, matfile[key])
         self.numOfJunctions = self.number_of_junctions
         self.numOfWires = self.number_of_wires
 
+    def __getattr__(self, name):
+        # network files do not store adj_matrix, build it on first use
+        if name == 'adj_matrix' and 'edge_list' in self.__dict__:
+            from networkFile import adjacencyMatrix
+            self.adj_matrix = adjacencyMatrix(self.edge_list, self.number_of_wires)
+            return self.adj_matrix
+        raise AttributeError(name)
+
 class junctionState__:
     def __init__(self, NumOfJunctions, setVoltage=1e-2, resetVoltage=1e-3,
-                criticalFlux=1e-1, maxFlux=1.5e-1):
-        self.type = 'Atomic_Switch'
-        self.voltage = np.zeros(NumOfJunctions)
-        self.resistance = np.zeros(NumOfJunctions)
-        self.onResistance = np.ones(NumOfJunctions)*1e4
-        self.offResistance = np.ones(NumOfJunctions)*1e7
-
-        self.filamentState = np.zeros(NumOfJunctions)
-        self.OnOrOff = np.full(NumOfJunctions, False, dtype=bool)
+                criticalFlux=1e-1, maxFlux=1.5e-1, batchSize=None, backend=None,
+                model='binary'):
+        """
+        With batchSize = B every array has shape (B, NumOfJunctions) and
+        holds B independent copies of the network, see simulateNetworkBatch.
+
+        The updates overwrite filamentState, resistance and OnOrOff in
+        place (see junctionKernels.py), copy them to keep a snapshot.
+        backend is 'numpy' (default) or 'numba' (needs numba installed).
+
+        model is the junction model, a name or an instance of
+        junctionModels.py ('binary' atomic switch, 'tunnelling', 'linear').
+        """
+        from junctionKernels import defaultBackend, checkBackend
+        from junctionModels import getJunctionModel
+        if batchSize is None:
+            shape = NumOfJunctions
+        else:
+            shape = (batchSize, NumOfJunctions)
+        self.model = getJunctionModel(model)
+        self.type = self.model.type
+        self.voltage = np.zeros(shape)
+        self.resistance = np.zeros(shape)
+        self.onResistance = np.ones(shape)*1e4
+        self.offResistance = np.ones(shape)*1e7
+
+        self.filamentState = np.zeros(shape)
+        self.OnOrOff = np.full(shape, False, dtype=bool)
         self.setVoltage = setVoltage
         self.resetVoltage = resetVoltage
         self.critialFlux = criticalFlux
         self.maxFlux = maxFlux
+        self.backend = backend or defaultBackend
+        checkBackend(self.backend)
 
     def updateResistance(self):
-        self.OnOrOff = abs(self.filamentState) >= self.critialFlux
-        self.resistance = self.offResistance + \
-                            (self.onResistance-self.offResistance)*self.OnOrOff
+        self.model.updateResistance(self)
 
     def updateJunctionState(self, dt):
-        self.filamentState = self.filamentState + \
-                            (abs(self.voltage) > self.setVoltage) *\
-                            (abs(self.voltage) - self.setVoltage) *\
-                            np.sign(self.voltage) * dt
-        self.filamentState = self.filamentState - \
-                            (abs(self.voltage) < self.resetVoltage) *\
-                            (self.resetVoltage - abs(self.voltage)) *\
-                            np.sign(self.filamentState) * dt * 10    
-        maxPosition = np.where(abs(self.filamentState) > self.maxFlux)[0]
-        self.filamentState[maxPosition] = np.sign(self.filamentState[maxPosition]) * \
-                                            self.maxFlux
+        self.model.advance(self, self.voltage, dt)
 
 class stimulus__:
     def __init__(self, biasType='DC', nanowire = 0,
@@ -91,8 +116,33 @@ class stimulus__:
             pass
         
 def simulateNetworkPlus(simulationOptions, 
-                        connectivity, junctionState):
+                        connectivity, junctionState,
+                        solver = 'dense', recorder = None, portModel = False,
+                        startStep = 0):
+    """
+    solver = 'dense' solves the augmented MNA system with np.linalg.solve,
+    bit-identical to the original code, and skips the solve on steps on
+    which no junction switched and the electrode voltages are unchanged.
+    solver = 'direct' (sparse LU) or 'cg' (Jacobi-preconditioned CG) work
+    on the sparse free-wire Laplacian and scale to thousands of wires.
+    All three keep their matrix between steps (see mna.py); the sparse
+    ones only refactorise when a junction switched, and 'direct' absorbs
+    small switching events with a Woodbury update instead.
+
+    recorder (see recorder.py) chooses which traces are kept, for which
+    junctions and wires, at which steps, and whether they stay in RAM or
+    are streamed to .npy files on disk.
 
+    portModel = True solves the steps on which no junction switched with
+    the Kron-reduced port model of mna.py, which is built once per quiet
+    phase (one solve per electrode) and then costs a matrix-vector product
+    per step. It pays off for binary junction models with long phases
+    without switching.
+
+    startStep resumes a protocol: the run starts at TimeVector[startStep]
+    with stimulus sample startStep (e.g. checkpoint__.step, see
+    checkpoint.py) and records the steps from there on.
+    """
     niterations = simulationOptions.NumOfIterations
     electrodes = simulationOptions.electrodes
     numOfElectrodes = len(electrodes)
@@ -100,64 +150,65 @@ def simulateNetworkPlus(simulationOptions,
     V = connectivity.numOfWires
 
     edgeList = connectivity.edge_list
-    adjMat = connectivity.adj_matrix
-    rhs = np.zeros(V+numOfElectrodes)
 
-    import dataStruct 
+    import dataStruct
     Network = dataStruct.network__()
-    Network.filamentState = np.zeros((niterations, E))
-    Network.junctionVoltage = np.zeros((niterations, E))
-    Network.junctionResistance = np.zeros((niterations, E))
-    Network.junctionSwitch = np.zeros((niterations, E), dtype = bool)
-    Network.networkCurrent = np.zeros(niterations)
-    Network.wireVoltage = np.zeros((niterations, V))
-    Network.electrodeCurrent = np.zeros((niterations, numOfElectrodes))
+    Network.networkCurrent = np.zeros(niterations - startStep)
 
-    Network.sources = []
-    Network.drains = []
-    for i in range(numOfElectrodes):
-        if np.mean(simulationOptions.stimulus[i].signal) != 0:
-            Network.sources.append(electrodes[i]+1)
-        else:
-            Network.drains.append(electrodes[i]+1)
+    from recorder import recorder__
+    if recorder is None:
+        recorder = recorder__()
+    recorder.allocate(niterations, dict(filamentState = (E, float, 'junction'),
+                                        junctionVoltage = (E, float, 'junction'),
+                                        junctionResistance = (E, float, 'junction'),
+                                        junctionSwitch = (E, bool, 'junction'),
+                                        wireVoltage = (V, float, 'wire'),
+                                        electrodeCurrent = (numOfElectrodes, float, None)),
+                        startStep)
+
+    from mna import mnaSolver__
+    from junctionModels import solverOptions
+    engine = mnaSolver__(connectivity, electrodes, solver = solver, **solverOptions(junctionState))
 
-    for this_time in tqdm(range(niterations), desc='Running Simulation '):
+    for this_time in tqdm(range(startStep, niterations), desc='Running Simulation '):
         junctionState.updateResistance()
         junctionConductance = 1/junctionState.resistance
-        
-        Gmat = np.zeros((V,V))
-        Gmat[edgeList[:,0], edgeList[:,1]] = junctionConductance
-        Gmat[edgeList[:,1], edgeList[:,0]] = junctionConductance
-        Gmat = np.diag(np.sum(Gmat,axis=0)) - Gmat
-
-        lhs = np.zeros((V+numOfElectrodes, V+numOfElectrodes))
-        lhs[0:V,0:V] = Gmat
-        for i in range(numOfElectrodes):
-            this_elec = electrodes[i],
-            lhs[V+i, this_elec] = 1
-            lhs[this_elec, V+i] = 1
-            rhs[V+i] = simulationOptions.stimulus[i].signal[this_time]
-        
-        # from scipy.sparse import csc_matrix
-        # from scipy.sparse.linalg import spsolve
-        # LHS = csc_matrix(lhs)
-        # RHS = csc_matrix(rhs.reshape(V+numOfElectrodes,1))
-        # sol = spsolve(LHS,RHS)
-
-        sol = np.linalg.solve(lhs,rhs)
-        wireVoltage = sol[0:V]
+        elecVoltage = [simulationOptions.stimulus[i].signal[this_time] for i in range(numOfElectrodes)]
+        engine.setConductance(junctionConductance)
+        if portModel and engine.changed.size == 0:
+            wireVoltage, electrodeCurrent = engine.solvePorts(elecVoltage)
+        else:
+            wireVoltage, electrodeCurrent = engine.solve(elecVoltage)
+
         junctionState.voltage = wireVoltage[edgeList[:,0]] - wireVoltage[edgeList[:,1]]
         junctionState.updateJunctionState(simulationOptions.dt)
 
-        Network.wireVoltage[this_time,:] = wireVoltage
-        Network.electrodeCurrent[this_time,:] = sol[V:]
-        Network.filamentState[this_time,:] = junctionState.filamentState
-        Network.junctionVoltage[this_time,:] = junctionState.voltage
-        Network.junctionResistance[this_time,:] = junctionState.resistance
-        Network.junctionSwitch[this_time,:] = junctionState.OnOrOff
+        if recorder.wants(this_time, junctionState.OnOrOff):
+            recorder.record(this_time, wireVoltage = wireVoltage,
+                            electrodeCurrent = electrodeCurrent,
+                            filamentState = junctionState.filamentState,
+                            junctionVoltage = junctionState.voltage,
+                            junctionResistance = junctionState.resistance,
+                            junctionSwitch = junctionState.OnOrOff)
+
+    Network = packNetwork(Network, simulationOptions, connectivity,
+                        junctionState, simulationOptions.stimulus)
+    return recorder.finish(Network)
+
+def packNetwork(Network, simulationOptions, connectivity, junctionState, stimulus):
+    electrodes = simulationOptions.electrodes
+    numOfElectrodes = len(electrodes)
+
+    Network.sources = []
+    Network.drains = []
+    for i in range(numOfElectrodes):
+        if np.mean(stimulus[i].signal) != 0:
+            Network.sources.append(electrodes[i]+1)
+        else:
+            Network.drains.append(electrodes[i]+1)
 
-    Network.numOfWires = V
-    Network.numOfJunctions = E
+    Network.numOfWires = connectivity.numOfWires
+    Network.numOfJunctions = connectivity.numOfJunctions
     Network.adjMat = connectivity.adj_matrix
     Network.graph = nx.from_numpy_array(connectivity.adj_matrix)
     Network.shortestPaths = [p for p in nx.all_shortest_paths(Network.graph, 
@@ -166,9 +217,113 @@ def simulateNetworkPlus(simulationOptions,
     Network.shortestPaths = np.add(Network.shortestPaths, 1)
     Network.contactWires = simulationOptions.interfaceElectrodes
     Network.criticalFlux = junctionState.critialFlux
-    Network.stimulus = [simulationOptions.stimulus[i] for i in range(numOfElectrodes)]
+    Network.stimulus = [stimulus[i] for i in range(numOfElectrodes)]
     Network.junctionList = np.add(connectivity.edge_list, 1).T
     Network.connectivity = connectivity
     Network.TimeVector = simulationOptions.TimeVector
 
-    return Network
\ No newline at end of file
+    return Network
+
+def stackJunctionStates(junctionStates):
+    """
+    Combine a list of junctionState__ objects (e.g. different seeds or
+    pre-formed states) into one batched junctionState__.
+    """
+    first = junctionStates[0]
+    batch = junctionState__(first.filamentState.size, batchSize=len(junctionStates),
+                            setVoltage=first.setVoltage, resetVoltage=first.resetVoltage,
+                            criticalFlux=first.critialFlux, maxFlux=first.maxFlux,
+                            backend=getattr(first, 'backend', None),
+                            model=getattr(first, 'model', None))
+    for field in ['voltage', 'resistance', 'onResistance', 'offResistance',
+                'filamentState', 'OnOrOff']:
+        setattr(batch, field, np.array([getattr(js, field) for js in junctionStates]))
+    return batch
+
+def simulateNetworkBatch(simulationOptions, connectivity, junctionState, stimuli):
+    """
+    Run B independent realisations on the same connectivity in lockstep.
+    stimuli is a list of B stimulus lists (one stimulus__ per electrode),
+    junctionState a batched junctionState__ (see batchSize and
+    stackJunctionStates). Each step, the members whose junctions switched
+    or whose electrode voltages changed are solved together with one
+    batched np.linalg.solve; the others keep their previous solution.
+    Returns a list of B network__ objects, as from simulateNetworkPlus.
+    simulateNetworkPlus with solver = 'dense' solves the same matrices
+    with the same np.linalg.solve, so each member is bit-identical to the
+    serial run; the sparse solvers agree with it to rounding only.
+    """
+    niterations = simulationOptions.NumOfIterations
+    electrodes = simulationOptions.electrodes
+    numOfElectrodes = len(electrodes)
+    E = connectivity.numOfJunctions
+    V = connectivity.numOfWires
+    B = len(stimuli)
+    edgeList = connectivity.edge_list
+
+    signals = np.array([[stimulus[i].signal for i in range(numOfElectrodes)] for stimulus in stimuli])
+
+    # Off-diagonal and electrode entries sit at fixed positions, so the
+    # stacked matrices are allocated once and only refilled each step.
+    from mna import incidenceMatrix
+    degree = abs(incidenceMatrix(edgeList, V)).T.tocsr()
+    diagonal = np.arange(V)
+    lhs = np.zeros((B, V+numOfElectrodes, V+numOfElectrodes))
+    for i in range(numOfElectrodes):
+        lhs[:, V+i, electrodes[i]] = 1
+        lhs[:, electrodes[i], V+i] = 1
+    rhs = np.zeros((B, V+numOfElectrodes, 1))
+    sol = np.zeros((B, V+numOfElectrodes))
+    lastConductance = np.zeros((B, E))
+
+    filamentState = np.zeros((B, niterations, E))
+    junctionVoltage = np.zeros((B, niterations, E))
+    junctionResistance = np.zeros((B, niterations, E))
+    junctionSwitch = np.zeros((B, niterations, E), dtype = bool)
+    wireVoltage = np.zeros((B, niterations, V))
+    electrodeCurrent = np.zeros((B, niterations, numOfElectrodes))
+
+    for this_time in tqdm(range(niterations), desc='Running Batch Simulation '):
+        junctionState.updateResistance()
+        junctionConductance = 1/junctionState.resistance
+
+        switched = np.any(junctionConductance != lastConductance, axis=1)
+        if switched.any():
+            g = junctionConductance[switched]
+            members = np.flatnonzero(switched)[:,None]
+            lhs[members, edgeList[:,0], edgeList[:,1]] = -g
+            lhs[members, edgeList[:,1], edgeList[:,0]] = -g
+            lhs[members, diagonal, diagonal] = (degree @ g.T).T
+            lastConductance[switched] = g
+
+        stepped = np.any(rhs[:, V:, 0] != signals[:, :, this_time], axis=1)
+        rhs[:, V:, 0] = signals[:, :, this_time]
+        active = np.flatnonzero(switched | stepped | (this_time == 0))
+        if active.size > 0:
+            sol[active] = np.linalg.solve(lhs[active], rhs[active])[:, :, 0]
+
+        junctionState.voltage = sol[:, edgeList[:,0]] - sol[:, edgeList[:,1]]
+        junctionState.updateJunctionState(simulationOptions.dt)
+
+        wireVoltage[:, this_time, :] = sol[:, 0:V]
+        electrodeCurrent[:, this_time, :] = sol[:, V:]
+        filamentState[:, this_time, :] = junctionState.filamentState
+        junctionVoltage[:, this_time, :] = junctionState.voltage
+        junctionResistance[:, this_time, :] = junctionState.resistance
+        junctionSwitch[:, this_time, :] = junctionState.OnOrOff
+
+    import dataStruct
+    Networks = []
+    for b in range(B):
+        Network = dataStruct.network__()
+        Network.filamentState = filamentState[b]
+        Network.junctionVoltage = junctionVoltage[b]
+        Network.junctionResistance = junctionResistance[b]
+        Network.junctionSwitch = junctionSwitch[b]
+        Network.networkCurrent = np.zeros(niterations)
+        Network.wireVoltage = wireVoltage[b]
+        Network.electrodeCurrent = electrodeCurrent[b]
+        Networks.append(packNetwork(Network, simulationOptions, connectivity,
+                                    junctionState, stimuli[b]))
+
+    return Networks
\ No newline at end of file
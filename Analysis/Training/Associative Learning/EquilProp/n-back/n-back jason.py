@@ -33,6 +33,9 @@ fileName='/import/silo2/aloe8475/Documents/Data/Associative Learning/Sparse Netw
 
 #import edamame (neuromorphic nanowire python package by Ruomin Zhu)
 from edamame import * 
+#recording policy shared with the multi-electrode simulator
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../Assoc_Learning_Task_Simulation/Python/multiElec'))
+from recorder import recorder__
 import numpy as np
 import matplotlib.pyplot as plt
 import copy
@@ -228,6 +231,7 @@ def runSim_backprop(Connectivity,
                     f = 1, customSignal = None,
                     start_state = None,
                     lite_mode = False, save_steps = 1,
+                    recorder = None,
                     findFirst = True,
                     disable_tqdm = False,
                     freeze_wire = None, freeze_junction = None, 
@@ -236,6 +240,7 @@ def runSim_backprop(Connectivity,
     """
     For the case of multi electrodes, stimulus should be in parameters.
     See help(stimulus__) for how to generate stimulus__ objects.
+    recorder (a recorder__) overrides lite_mode and save_steps.
     """
 
     SimulationOptions = simulationOptions__(dt = dt, T = T,
@@ -289,7 +294,7 @@ def runSim_backprop(Connectivity,
                     freeze_junction = freeze_junction, 
                     freeze_TimeStamp = freeze_TimeStamp)
         
-    this_realization,cost = simulateNetwork_backprop(SimulationOptions, Connectivity, JunctionState,tmpTiming,tmpTargets, lite_mode, disable_tqdm, save_steps, **kwdict)
+    this_realization,cost = simulateNetwork_backprop(SimulationOptions, Connectivity, JunctionState,tmpTiming,tmpTargets, lite_mode, disable_tqdm, save_steps, recorder = recorder, **kwdict)
     
     if findFirst:
         from edamame.analysis.GraphTheory import findCurrent
@@ -301,7 +306,7 @@ def runSim_backprop(Connectivity,
 
     return this_realization,cost   
 
-def simulateNetwork_backprop(simulationOptions, connectivity, junctionState,tmpTiming,tmpTargets, lite_mode = False, disable_tqdm = False, save_steps = 1, **kwargs):
+def simulateNetwork_backprop(simulationOptions, connectivity, junctionState,tmpTiming,tmpTargets, lite_mode = False, disable_tqdm = False, save_steps = 1, recorder = None, **kwargs):
     niterations = simulationOptions.NumOfIterations
     electrodes = simulationOptions.electrodes
     numOfElectrodes = len(electrodes)
@@ -316,23 +321,23 @@ def simulateNetwork_backprop(simulationOptions, connectivity, junctionState,tmpT
     grad      = np.zeros((n)) #set gradients to zero for each epoch  
 
     Network = network__()
-    sampling = np.arange(0, niterations, save_steps)
+    if recorder is None:
+        if lite_mode:
+            recorder = recorder__(fields = ['filamentState', 'wireVoltage', 'electrodeCurrent'],
+                                every = save_steps)
+        else:
+            recorder = recorder__()
     if lite_mode:
         Network.connectivity = connectivity__(adjMat = connectivity.adj_matrix)
-        Network.filamentState = np.zeros((int(niterations/save_steps), E))
-        Network.wireVoltage = np.zeros((int(niterations/save_steps), V))
-        Network.electrodeCurrent = np.zeros((int(niterations/save_steps), numOfElectrodes))
-        Network.TimeVector = np.zeros(int(niterations/save_steps))
     else:        
         Network.connectivity = connectivity
-        Network.TimeVector = simulationOptions.TimeVector
-        Network.filamentState = np.zeros((niterations, E))
-        Network.junctionVoltage = np.zeros((niterations, E))
-        # Network.junctionResistance = np.zeros((niterations, E))
-        Network.junctionConductance = np.zeros((niterations, E))
-        Network.junctionSwitch = np.zeros((niterations, E), dtype = bool)
-        Network.wireVoltage = np.zeros((niterations, V))
-        Network.electrodeCurrent = np.zeros((niterations, numOfElectrodes))
+    Network.TimeVector = simulationOptions.TimeVector
+    recorder.allocate(niterations, dict(filamentState = (E, float, 'junction'),
+                                        junctionVoltage = (E, float, 'junction'),
+                                        junctionConductance = (E, float, 'junction'),
+                                        junctionSwitch = (E, bool, 'junction'),
+                                        wireVoltage = (V, float, 'wire'),
+                                        electrodeCurrent = (numOfElectrodes, float, None)))
 
     Network.sources = []
     Network.drains = []
@@ -382,22 +387,17 @@ def simulateNetwork_backprop(simulationOptions, connectivity, junctionState,tmpT
         else:
             wireVoltage = sol[0:V]
             
-        if lite_mode:
-            if this_time%save_steps == 0:
-                Network.wireVoltage[this_time//save_steps,:] = wireVoltage
-                Network.electrodeCurrent[this_time//save_steps,:] = sol[V:]
-                Network.filamentState[this_time//save_steps,:] = junctionState.filamentState
-                Network.TimeVector[this_time//save_steps] = simulationOptions.TimeVector[this_time]
-        else:
-            Network.wireVoltage[this_time,:] = wireVoltage
-            Network.electrodeCurrent[this_time,:] = sol[V:]
-            Network.filamentState[this_time,:] = junctionState.filamentState
-            Network.junctionVoltage[this_time,:] = junctionState.voltage
-            Network.junctionConductance[this_time,:] = junctionState.conductance
-            Network.junctionSwitch[this_time,:] = junctionState.OnOrOff
+        if recorder.wants(this_time, junctionState.OnOrOff):
+            recorder.record(this_time, wireVoltage = wireVoltage,
+                            electrodeCurrent = sol[V:],
+                            filamentState = junctionState.filamentState,
+                            junctionVoltage = junctionState.voltage,
+                            junctionConductance = junctionState.conductance,
+                            junctionSwitch = junctionState.OnOrOff)
         
         ## BackProp Implementation
-        y = Network.electrodeCurrent[this_time,:num_drain_training]
+        # taken from the solution, the recorder may not keep this step
+        y = sol[V:V+num_drain_training]
         
         if tmpTargets[this_time] != -1: #skip rest values
             tarIdx=tmpTargets[this_time]
@@ -450,10 +450,12 @@ def simulateNetwork_backprop(simulationOptions, connectivity, junctionState,tmpT
     Network.numOfWires = V
     Network.numOfJunctions = E
     Network.electrodes = simulationOptions.electrodes
-    if len(electrodes) <= 2:
-        Network.conductance = Network.electrodeCurrent[:,1]/simulationOptions.stimulus[0].signal[sampling]
+    recorder.finish(Network)
+    if len(electrodes) <= 2 and hasattr(Network, 'electrodeCurrent'):
+        Network.conductance = Network.electrodeCurrent[:,1]/simulationOptions.stimulus[0].signal[Network.recordedSteps]
     if not lite_mode:
         Network.stimulus = [simulationOptions.stimulus[i] for i in range(numOfElectrodes)]
+    if hasattr(Network, 'junctionConductance'):
         Network.junctionResistance = 1/Network.junctionConductance
         
     return Network,cost